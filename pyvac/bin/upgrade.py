@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Upgrade the database of an existing installation to the current models.
+"""
+
+import os
+import sys
+
+from pyramid.paster import get_appsettings, setup_logging
+from sqlalchemy import inspect, select, func, and_
+from sqlalchemy.schema import CreateColumn
+
+from pyvac.helpers.sqla import dispose_engine
+from pyvac.models import (create_engine, DBSession, Base, Pool, UserPool,
+                          UserPoolSnapshot)
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print(('usage: %s <config_uri>\n'
+          '(example: "%s development.ini")' % (cmd, cmd)))
+    sys.exit(1)
+
+
+def upgrade_schema(engine):
+    """Add missing columns and indexes to existing tables."""
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    tables = inspector.get_table_names()
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+
+        columns = [col['name'] for col in inspector.get_columns(table.name)]
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            ddl = CreateColumn(column).compile(dialect=engine.dialect)
+            engine.execute('ALTER TABLE %s ADD COLUMN %s' %
+                           (preparer.format_table(table), ddl))
+            print(('added column %s.%s' % (table.name, column.name)))
+
+        indexes = [idx['name'] for idx in inspector.get_indexes(table.name)]
+        for index in table.indexes:
+            if index.name in indexes:
+                continue
+            if index.unique:
+                duplicates = find_duplicates(engine, index)
+                if duplicates:
+                    print(('cannot add unique index %s, duplicate values:'
+                           % index.name))
+                    for row in duplicates:
+                        print(('  %r found %d times' % (tuple(row[:-1]),
+                                                        row[-1])))
+                    continue
+            create_index(engine, index)
+            print(('added index %s' % index.name))
+
+
+def find_duplicates(engine, index):
+    """Return values violating a unique index, with their count."""
+    columns = list(index.columns)
+    count = func.count()
+    query = select(columns + [count]).\
+        where(and_(*[col.isnot(None) for col in columns])).\
+        group_by(*columns).having(count > 1)
+    return engine.execute(query).fetchall()
+
+
+def create_index(engine, index):
+    """Create an index without locking writes on its table if possible."""
+    if engine.dialect.name != 'postgresql':
+        index.create(engine)
+        return
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    index.dialect_options['postgresql']['concurrently'] = True
+    try:
+        conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        with conn:
+            try:
+                index.create(conn)
+            except Exception:
+                # a failed concurrent build leaves an INVALID index behind
+                conn.execute('DROP INDEX CONCURRENTLY IF EXISTS %s' %
+                             engine.dialect.identifier_preparer.quote(
+                                 index.name))
+                raise
+    finally:
+        index.dialect_options['postgresql']['concurrently'] = False
+
+
+def upgrade(engine):
+    upgrade_schema(engine)
+    # create missing tables
+    Base.metadata.create_all(engine)
+    session = DBSession()
+
+    # compute balance snapshots from existing event logs
+    userpools = UserPool.find(session)
+    for userpool in userpools:
+        UserPoolSnapshot.rebuild(session, userpool)
+    print(('rebuilt snapshots for %d userpools' % len(userpools)))
+
+    # compute heartbeat watermark of pools
+    pools = Pool.find(session)
+    for pool in pools:
+        pool.date_next_due = pool.get_next_due()
+    print(('updated heartbeat watermark for %d pools' % len(pools)))
+
+    session.commit()
+
+
+def main(argv=sys.argv):
+    if len(argv) != 2:
+        usage(argv)
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+    engine = create_engine(settings, scoped=False)
+    upgrade(engine)
+    dispose_engine('pyvac')
@@ -8,6 +8,7 @@ from pyramid.exceptions import Forbidden
 from pyramid_jinja2 import renderer_factory
 from pyramid.settings import asbool
 
+import redis
 import yaml
 
 try:
@@ -21,8 +22,10 @@ except ImportError:
     from logutils.dictconfig import dictConfig
 
 from pyvac.helpers.ldap import LdapCache
+from pyvac.helpers.cache import RedisCache
 from pyvac.helpers.i18n import locale_negotiator
 from pyvac.helpers.holiday import init_override
+from pyvac.security import get_user, GroupFinder
 
 
 def configure(filename='conf/pyvac.yaml', init_celery=True, default_app=None):
@@ -80,6 +83,17 @@ def includeme(config):
                 content = yaml.load(fdesc, YAMLLoader)
         init_override(content)
 
+    # users groups cache bounds
+    if 'pyvac.groups_cache_ttl' in settings:
+        GroupFinder.cache.ttl = int(settings['pyvac.groups_cache_ttl'])
+    if 'pyvac.groups_cache_size' in settings:
+        GroupFinder.cache.maxsize = int(settings['pyvac.groups_cache_size'])
+    # share users groups between workers, so changes are seen by all
+    if 'pyvac.groups_cache_url' in settings:
+        client = redis.StrictRedis.from_url(settings['pyvac.groups_cache_url'])
+        GroupFinder.cache = RedisCache(client, 'pyvac:groups:',
+                                       GroupFinder.cache.ttl)
+
     # call includeme for models configuration
     config.include('pyvac.models')
 
@@ -100,6 +114,8 @@ def includeme(config):
     # i18n
     config.add_translation_dirs('locale/')
     config.set_locale_negotiator(locale_negotiator)
+    # authenticated user, loaded once per request
+    config.add_request_method(get_user, 'user', reify=True)
 
     # Javascript + Media
     config.add_static_view('static', 'static', cache_max_age=3600)
@@ -237,6 +253,10 @@ def includeme(config):
                     route_name='whoswho',
                     renderer='templates/whoswho.html')
 
+    config.add_route('user_photo', r'/pyvac/photo/{user_id:\d+}')
+    config.add_view('pyvac.views.account.Photo',
+                    route_name='user_photo')
+
     config.add_route('export_request', '/pyvac/export')
     config.add_view('pyvac.views.request.Export',
                     route_name='export_request',
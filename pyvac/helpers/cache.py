@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from redis.exceptions import RedisError
+
+log = logging.getLogger(__name__)
+
+
+class TTLCache(object):
+    """Process local cache whose entries expire after ttl seconds.
+
+    When maxsize is set, least recently used entries are evicted first.
+    """
+
+    def __init__(self, ttl, maxsize=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, build):
+        """Return cached value for key, calling build() on a miss."""
+        now = datetime.now()
+        if key in self.entries:
+            expire, value = self.entries.pop(key)
+            if expire > now:
+                self.entries[key] = (expire, value)
+                return value
+
+        value = build()
+        self.entries[key] = (now + timedelta(seconds=self.ttl), value)
+        self.evict(now)
+        return value
+
+    def evict(self, now):
+        for key, (expire, value) in list(self.entries.items()):
+            if expire <= now:
+                del self.entries[key]
+        if self.maxsize:
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop given key, or all entries if no key is given."""
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+
+class RedisCache(object):
+    """Cache shared by all processes, stored in redis.
+
+    Entries expire after ttl seconds, values must be JSON serializable.
+    When redis is unavailable values are built on each call.
+    """
+
+    def __init__(self, client, prefix, ttl):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def __contains__(self, key):
+        try:
+            return bool(self.client.exists(self.prefix + key))
+        except RedisError:
+            return False
+
+    def get(self, key, build):
+        """Return cached value for key, calling build() on a miss."""
+        try:
+            value = self.client.get(self.prefix + key)
+        except RedisError:
+            log.exception('cannot read %s from redis cache' % key)
+            return build()
+        if value is not None:
+            return json.loads(value)
+
+        value = build()
+        try:
+            self.client.setex(self.prefix + key, self.ttl, json.dumps(value))
+        except RedisError:
+            log.exception('cannot write %s in redis cache' % key)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop given key, or all entries if no key is given."""
+        try:
+            if key is not None:
+                self.client.delete(self.prefix + key)
+                return
+            keys = list(self.client.scan_iter(match=self.prefix + '*'))
+            if keys:
+                self.client.delete(*keys)
+        except RedisError:
+            log.exception('cannot invalidate redis cache')
@@ -9,6 +9,9 @@ from workalendar.europe import France, Luxembourg
 from workalendar.usa import California
 from workalendar.asia import Taiwan
 
+from pyvac.helpers.cache import TTLCache
+from pyvac.helpers.util import daterange
+
 log = logging.getLogger(__file__)
 
 conv_table = {
@@ -20,6 +23,9 @@ conv_table = {
 
 override = {}
 
+# holidays per (country, year), only overrides loading changes them
+calendars = TTLCache(86400, maxsize=100)
+
 
 def init_override(content):
     """Load a yaml file for holidays override.
@@ -36,7 +42,11 @@ zh:
     """
     if not content:
         return
-    override.update(content)
+    for country, years in content.items():
+        for year, dates in years.items():
+            override.setdefault(country, {})[year] = [
+                datetime.strptime(dt, '%Y-%m-%d') for dt in dates]
+    calendars.invalidate()
 
 
 def utcify(date):
@@ -44,40 +54,49 @@ def utcify(date):
     return calendar.timegm(date.timetuple()) * 1000
 
 
-def get_holiday(user, year=None, use_datetime=False):
-    """ return holidays for user country
+def get_calendar(country, year):
+    """ return holidays of a country for a year
 
-    format is unixtime for javascript
+    as a frozenset of datetimes and a tuple of javascript timestamps
     """
-    klass = conv_table[user.country]
+    def build():
+        if year in override.get(country, {}):
+            raw = override[country][year]
+        else:
+            raw = [dt for dt, _ in conv_table[country]().holidays(year)]
+        # must cast to datetime as workalendar returns only Date objects
+        dates = frozenset(datetime(dt.year, dt.month, dt.day) for dt in raw)
+        timestamps = tuple(utcify(dt) for dt in raw)
+        return dates, timestamps
+
+    return calendars.get((country, year), build)
+
+
+def get_holiday(user, year=None, use_datetime=False):
+    """ return holidays for user country for given year and the next one
 
-    cal = klass()
+    format is unixtime for javascript, or a frozenset of datetimes when
+    use_datetime is set
+    """
     current_year = year or datetime.now().year
-    next_year = current_year + 1
-
-    # retrieve Dates from workalendar
-    holiday_current_raw = [dt for dt, _ in cal.holidays(current_year)]
-    holiday_next_raw = [dt for dt, _ in cal.holidays(next_year)]
-
-    if user.country in override and current_year in override[user.country]:
-        holiday_current_raw = [datetime.strptime(dt, '%Y-%m-%d')
-                               for dt in
-                               override[user.country][current_year]]
-
-    if user.country in override and next_year in override[user.country]:
-        holiday_next_raw = [datetime.strptime(dt, '%Y-%m-%d')
-                            for dt in
-                            override[user.country][next_year]]
-
-    if not use_datetime:
-        # must cast to javascript timestamp
-        holiday_current = [utcify(dt) for dt in holiday_current_raw]
-        holiday_next = [utcify(dt) for dt in holiday_next_raw]
-    else:
-        # must cast to datetime as workalendar returns only Date objects
-        holiday_current = [datetime(dt.year, dt.month, dt.day)
-                           for dt in holiday_current_raw]
-        holiday_next = [datetime(dt.year, dt.month, dt.day)
-                        for dt in holiday_next_raw]
+    current_cal = get_calendar(user.country, current_year)
+    next_cal = get_calendar(user.country, current_year + 1)
+
+    if use_datetime:
+        return current_cal[0] | next_cal[0]
+
+    return list(current_cal[1] + next_cal[1])
 
-    return holiday_current + holiday_next
+
+def workdays(date_from, date_to, country=None):
+    """ return working days between two dates, bounds included
+
+    weekends are skipped, and holidays of given country when set
+    """
+    holidays = frozenset()
+    if country:
+        holidays = holidays.union(*[get_calendar(country, year)[0]
+                                    for year in range(date_from.year,
+                                                      date_to.year + 1)])
+    return [date for date in daterange(date_from, date_to)
+            if date.isoweekday() not in [6, 7] and date not in holidays]
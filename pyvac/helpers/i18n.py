@@ -2,7 +2,6 @@ import os
 from pyramid.i18n import (
     TranslationStringFactory, get_localizer, make_localizer
 )
-from pyramid.security import authenticated_userid
 
 
 def locale_negotiator(request):
@@ -14,11 +13,8 @@ def locale_negotiator(request):
     the url parameter or the cookie, and fallbacks to the user's lang.
     """
 
-    login = authenticated_userid(request)
-    if login:
-        from pyvac.models import DBSession, User
-        session = DBSession()
-        user = User.by_login(session, login)
+    user = request.user
+    if user:
         if user.country == 'us':
             return 'en'
         if user.country == 'zh':
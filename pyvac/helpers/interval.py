@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+
+class IntervalIndex(object):
+    """Static interval index over requests.
+
+    Requests are sorted by date_from and stored as an implicit balanced
+    tree: each node keeps the greatest date_to of its subtree so whole
+    branches can be skipped. Overlap queries run in O(log n + k).
+
+    Items only need date_from, date_to and user_id attributes.
+    """
+
+    def __init__(self, items):
+        self.items = sorted(items, key=lambda item: (item.date_from,
+                                                     item.date_to))
+        self.max_end = [None] * len(self.items)
+        self._build(0, len(self.items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        max_end = self.items[mid].date_to
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > max_end:
+                max_end = child
+        self.max_end[mid] = max_end
+        return max_end
+
+    def _search(self, lo, hi, date_from, date_to, found):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self.max_end[mid] < date_from:
+            return
+        self._search(lo, mid, date_from, date_to, found)
+        item = self.items[mid]
+        # items on the right start after this one
+        if item.date_from > date_to:
+            return
+        if item.date_to >= date_from:
+            found.append(item)
+        self._search(mid + 1, hi, date_from, date_to, found)
+
+    def overlap(self, date_from, date_to):
+        """Return items overlapping [date_from, date_to], bounds included."""
+        found = []
+        self._search(0, len(self.items), date_from, date_to, found)
+        return found
+
+    def users_off(self, day):
+        """Return user ids having an item covering given day."""
+        return set(item.user_id for item in self.overlap(day, day))
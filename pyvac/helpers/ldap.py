@@ -13,7 +13,7 @@ except ImportError:
     from yaml import SafeLoader as YAMLLoader
 
 import ldap
-from ldap import dn, modlist, SERVER_DOWN, ALREADY_EXISTS
+from ldap import dn, modlist, SERVER_DOWN, ALREADY_EXISTS, NO_SUCH_OBJECT
 
 log = logging.getLogger(__file__)
 
@@ -461,12 +461,19 @@ class LdapWrapper(object):
         else:
             return [user_data]
 
-    def list_users(self):
-        """ Retrieve users informations """
+    def list_users(self, photo=True):
+        """ Retrieve users informations
+
+        photo can be disabled to not transfer jpegPhoto of every user
+        """
         # rebind with system dn
         self._bind(self.system_DN, self.system_password)
         # retrieve all users so we can extract OU
         required = None
+        if not photo:
+            required = [self.mail_attr, self.lastname_attr, self.login_attr,
+                        self.manager_attr, self.firstname_attr, 'ou', 'uid',
+                        'arrivalDate', 'mobile', 'userPassword']
         item = '&(mail=*)(|(c:dn:=zh)(c:dn:=fr)(c:dn:=lu)(c:dn:=us))'
         res = self._conn.search_s('%s' % self._base,
                                   ldap.SCOPE_SUBTREE,
@@ -476,6 +483,19 @@ class LdapWrapper(object):
             users[USER_DN] = self.parse_ldap_entry(USER_DN, entry)
         return users
 
+    def get_user_photo(self, user_dn):
+        """ Retrieve jpegPhoto of a user, None if not set """
+        # rebind with system dn
+        self._bind(self.system_DN, self.system_password)
+        try:
+            res = self._conn.search_s(user_dn, ldap.SCOPE_BASE,
+                                      '(objectClass=*)', ['jpegPhoto'])
+        except NO_SUCH_OBJECT:
+            return
+        for USER_DN, entry in res:
+            if entry.get('jpegPhoto'):
+                return entry['jpegPhoto'][0]
+
     def list_ou(self):
         """ Retrieve available organisational units """
         # rebind with system dn
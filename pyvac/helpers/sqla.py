@@ -1,8 +1,8 @@
 import re
 
-from zope.sqlalchemy import register
+from zope.sqlalchemy import register, mark_changed as zope_mark_changed
 
-from sqlalchemy import Column, Integer, DateTime, engine_from_config
+from sqlalchemy import Column, Integer, DateTime, engine_from_config, event
 from sqlalchemy.sql.expression import func
 
 from sqlalchemy.orm import scoped_session, sessionmaker, eagerload_all
@@ -139,16 +139,31 @@ class Database(object):
 class SessionFactory(object):
 
     sessions = {}
+    listeners = []
 
     @classmethod
     def register(cls, name, scoped, engine):
         if scoped:
-            cls.sessions[name] = scoped_session(sessionmaker(bind=engine))
+            # sessions joined to the zope transaction
+            factory = sessionmaker(bind=engine,
+                                   info={'transaction_managed': True})
+            cls.sessions[name] = scoped_session(factory)
             register(cls.sessions[name])
         else:
-            cls.sessions[name] = sessionmaker(bind=engine)
+            factory = sessionmaker(bind=engine)
+            cls.sessions[name] = factory
+        for identifier, fn in cls.listeners:
+            event.listen(factory, identifier, fn)
         return cls.sessions[name]
 
+    @classmethod
+    def listen(cls, identifier, fn):
+        """Register a session event listener on all session factories."""
+        cls.listeners.append((identifier, fn))
+        for session in cls.sessions.values():
+            event.listen(getattr(session, 'session_factory', session),
+                         identifier, fn)
+
     @classmethod
     def get(cls, name):
         return cls.sessions[name]
@@ -161,6 +176,16 @@ class SessionFactory(object):
             return None
 
 
+def mark_changed(session):
+    """Flag pending work which does not go through the session flush.
+
+    A zope managed session which did not emit any write is not committed
+    with the transaction, so work only kept in session.info would be lost.
+    """
+    if session.info.get('transaction_managed'):
+        zope_mark_changed(session)
+
+
 def create_engine(db_name, settings, prefix='sqlalchemy.', scoped=False):
     engine = engine_from_config(settings, prefix)
 
@@ -5,6 +5,7 @@ import re
 import logging
 import json
 import math
+import copy
 from datetime import datetime, timedelta
 
 from pyramid.settings import asbool, aslist
@@ -13,8 +14,9 @@ import cryptacular.bcrypt
 from sqlalchemy import (Table, Column, ForeignKey, Enum,
                         Integer, Float, Boolean, Unicode, DateTime,
                         UnicodeText, Index, UniqueConstraint)
-from sqlalchemy import or_, and_, func
-from sqlalchemy.orm import relationship, synonym, backref
+from sqlalchemy import or_, and_, case, func, event, exists, literal, select
+from sqlalchemy.orm import (relationship, synonym, backref, contains_eager,
+                            object_session)
 from sqlalchemy.ext.declarative import declared_attr
 
 import yaml
@@ -23,7 +25,7 @@ try:
 except ImportError:
     from yaml import SafeLoader as YAMLLoader
 
-from .helpers.sqla import (Database, SessionFactory, ModelError,
+from .helpers.sqla import (Database, SessionFactory, ModelError, mark_changed,
                            create_engine as create_engine_base,
                            dispose_engine as dispose_engine_base
                            )
@@ -31,8 +33,9 @@ from .helpers.sqla import (Database, SessionFactory, ModelError,
 from pyvac.helpers.ldap import LdapCache
 from pyvac.helpers.i18n import translate as _
 from pyvac.helpers.calendar import addToCal
-from pyvac.helpers.util import daterange
-from pyvac.helpers.holiday import utcify, get_holiday
+from pyvac.helpers.interval import IntervalIndex
+from pyvac.helpers.cache import TTLCache
+from pyvac.helpers.holiday import utcify, get_holiday, workdays
 
 log = logging.getLogger(__file__)
 crypt = cryptacular.bcrypt.BCRYPTPasswordManager()
@@ -145,6 +148,17 @@ class User(Base):
     feature_flags = {}
     users_flagfile = ''
 
+    @declared_attr
+    def __table_args__(cls):  # noqa
+        return (Index('idx_%s_login' % cls.__tablename__, 'login',
+                      unique=True),
+                Index('idx_%s_dn' % cls.__tablename__, 'dn'),
+                Index('idx_%s_manager_dn' % cls.__tablename__, 'manager_dn'),
+                Index('idx_%s_uid' % cls.__tablename__, 'uid'),
+                Index('idx_%s_country_id' % cls.__tablename__, 'country_id'),
+                {'mysql_engine': 'InnoDB', 'mysql_charset': 'utf8'},
+                )
+
     @property
     def name(self):
         """Internal helper to retrieve user name."""
@@ -634,11 +648,8 @@ class User(Base):
 
     def get_rtt_taken_year(self, session, year):
         """Retrieve taken RTT for a user for current year."""
-        valid_status = ['PENDING', 'ACCEPTED_MANAGER', 'APPROVED_ADMIN']
-        return sum([req.days for req in self.requests
-                    if (req.vacation_type.name == 'RTT') and
-                    (req.status in valid_status) and
-                    (req.date_from.year == year)])
+        return Request.by_user_type(session, self, 'RTT', year=year,
+                                    total=True)
 
     def get_rtt_usage(self, session):
         """Get RTT usage for a user."""
@@ -692,11 +703,7 @@ class User(Base):
     @classmethod
     def get_rtt_taken_history(cls, session, user, year):
         """Get RTT taken history."""
-        valid_status = ['PENDING', 'ACCEPTED_MANAGER', 'APPROVED_ADMIN']
-        entries = [req for req in user.requests
-                   if (req.vacation_type.name == 'RTT') and
-                   (req.status in valid_status) and
-                   (req.date_from.year == year)]
+        entries = Request.by_user_type(session, user, 'RTT', year=year)
 
         return [{'date': req.date_from, 'value': -req.days,
                  'flavor': '', 'req_id': req.id}
@@ -773,12 +780,8 @@ class User(Base):
     @classmethod
     def get_cp_taken_history(cls, session, user, date_start, date_end):
         """Get CP taken history."""
-        valid_status = ['PENDING', 'ACCEPTED_MANAGER', 'APPROVED_ADMIN']
-        entries = [req for req in user.requests
-                   if (req.vacation_type.name == 'CP') and
-                   (req.status in valid_status) and
-                   (req.date_from >= date_start) and
-                   (req.date_to <= date_end)]
+        entries = Request.by_user_type(session, user, 'CP', date_start,
+                                       date_end)
 
         # set taken to 12h hour so sorted history correctly put the acquired
         # before the taken
@@ -789,28 +792,13 @@ class User(Base):
 
     def get_cp_taken_year(self, session, date):
         """Retrieve taken CP for a user for current year."""
-        valid_status = ['PENDING', 'ACCEPTED_MANAGER', 'APPROVED_ADMIN']
-        return sum([req.days for req in self.requests
-                    if (req.vacation_type.name == 'CP') and
-                    (req.status in valid_status) and
-                    (req.date_from >= date)])
+        return Request.by_user_type(session, self, 'CP', date, total=True)
 
     def get_cp_taken_cycle(self, session, date_start, date_end,
                            return_req=False):
         """Retrieve taken CP for a user for current cycle."""
-        valid_status = ['PENDING', 'ACCEPTED_MANAGER', 'APPROVED_ADMIN']
-        if return_req:
-            return [req for req in self.requests
-                    if (req.vacation_type.name == 'CP') and
-                    (req.status in valid_status) and
-                    (req.date_from >= date_start) and
-                    (req.date_to <= date_end)]
-
-        return sum([req.days for req in self.requests
-                    if (req.vacation_type.name == 'CP') and
-                    (req.status in valid_status) and
-                    (req.date_from >= date_start) and
-                    (req.date_to <= date_end)])
+        return Request.by_user_type(session, self, 'CP', date_start, date_end,
+                                    total=not return_req)
 
     @classmethod
     def get_cp_history(cls, session, user, year, today=None):
@@ -899,9 +887,35 @@ class User(Base):
 
         return history, restant
 
+    @property
+    def cp_cache(self):
+        """Memoized CP usage per cycle, lives as long as this instance."""
+        if not hasattr(self, '_cp_cache'):
+            self._cp_cache = {}
+        return self._cp_cache
+
+    def reset_cp_cache(self):
+        """Invalidate memoized CP usage, to use when a CP request changes."""
+        self._cp_cache = {}
+
     def get_cp_usage(self, session, today=None, start=None, end=None,
                      taken_end=None):
-        """Get CP usage for a user."""
+        """Get CP usage for a user.
+
+        Usage is memoized for an explicit day only, a lookup at current time
+        would never be asked again.
+        """
+        if today is None:
+            return self._get_cp_usage(session, datetime.now(), start, end,
+                                      taken_end)
+        key = (today, start, end, taken_end)
+        if key not in self.cp_cache:
+            self.cp_cache[key] = self._get_cp_usage(session, today, start,
+                                                    end, taken_end)
+        return copy.deepcopy(self.cp_cache[key])
+
+    def _get_cp_usage(self, session, today, start, end, taken_end):
+        """Compute CP usage for a user."""
         kwargs = {'session': session,
                   'name': 'CP',
                   'country': self.country,
@@ -916,6 +930,10 @@ class User(Base):
         if not allowed:
             return
 
+        return self.get_cp_left(session, vac, allowed, taken_end)
+
+    def get_cp_left(self, session, vac, allowed, taken_end=None):
+        """Get CP usage for a user from given acquired values."""
         cycle_start = allowed['cycle_start']
         cycle_end = allowed['cycle_end']
         if taken_end:
@@ -938,20 +956,27 @@ class User(Base):
     def get_lu_holiday(self, today=None):
         """Return list of datetimes in last 3 months for LU user."""
         # retrieve Compensatoire taken history
-        valid_status = ['PENDING', 'ACCEPTED_MANAGER', 'APPROVED_ADMIN']
-        taken = [datetime.strptime(req.message, '%d/%m/%Y')
-                 for req in self.requests
-                 if (req.vacation_type.name == 'Compensatoire') and
-                 (req.status in valid_status)]
+        taken = set(datetime.strptime(req.message, '%d/%m/%Y')
+                    for req in Request.by_user_type(object_session(self),
+                                                    self, 'Compensatoire'))
 
         now = today or datetime.now()
-        compensatory = [dt for dt in get_holiday(self, year=now.year-1, use_datetime=True) # noqa
+        holidays = get_holiday(self, year=now.year - 1, use_datetime=True)
+        compensatory = [dt for dt in sorted(holidays)
                         if (dt not in taken) and
                         (dt.isoweekday() in [6, 7]) and
                         (dt - relativedelta(months=3) <= now <= (dt + relativedelta(months=3)))]  # noqa
         return compensatory
 
 
+@event.listens_for(User, 'expire')
+def reset_user_cp_cache(target, attrs):
+    """Memoized CP usage must not outlive the user loaded state."""
+    # target is None when the instance was garbage collected
+    if target is not None:
+        target.reset_cp_cache()
+
+
 vacation_type__country = Table('vacation_type__country', Base.metadata,
                                Column('vacation_type_id', Integer,
                                       ForeignKey('vacation_type.id')),
@@ -989,10 +1014,56 @@ class BaseVacation(object):
         return 0
 
     @classmethod
-    def check_seniority(cls, userpool):
-        """Called every day to check for user seniority bonus."""
+    def get_seniority_bonus(cls, pool, seniority):
+        """Return bonus credited on arrival anniversary for a pool."""
         return 0
 
+    @classmethod
+    def get_previous_cycle(cls, user, today, start=None, end=None):
+        """Return usage lookup of previous cycle, None for first cycle."""
+        raise NotImplementedError
+
+    @classmethod
+    def get_cycle_acquired(cls, user, today, session, previous_usage, first):
+        """Return acquired vacation of a cycle from previous cycle usage."""
+        raise NotImplementedError
+
+    @classmethod
+    def walk_cycles(cls, user, today, session, start=None, end=None):
+        """Return acquired vacation walking forward through cycles.
+
+        A cycle only depends on the usage of the previous one, so walk back
+        cycle boundaries until the first cycle or an already known usage,
+        then compute each cycle once from the oldest one.
+        """
+        lookups = [(today, start, end)]
+        previous = None
+        first = False
+        while True:
+            lookup = cls.get_previous_cycle(user, *lookups[-1])
+            if not lookup:
+                first = True
+                break
+            # user was not active yet, so there is no previous usage
+            if user.arrival_date > lookup[0]:
+                break
+            key = lookup + (None,)
+            if key in user.cp_cache:
+                previous = user.cp_cache[key]
+                break
+            lookups.append(lookup)
+
+        lookups.reverse()
+        for idx, lookup in enumerate(lookups):
+            allowed = cls.get_cycle_acquired(user, lookup[0], session,
+                                             previous, first and not idx)
+            if idx == len(lookups) - 1:
+                return allowed
+            previous = None
+            if allowed:
+                previous = user.get_cp_left(session, cls, allowed)
+            user.cp_cache[lookup + (None,)] = previous
+
 
 class CompensatoireVacation(BaseVacation):
     """Implement Compensatoire vacation behavior."""
@@ -1222,7 +1293,7 @@ class CPVacation(BaseVacation):
         """Retrieve cycle start and end date for given date.
 
         Will raise an exception if raising parameter is passed,
-        this is useful for stopping recursion calls.
+        this is useful for detecting the first cycle.
         """
         if date >= datetime(date.year, 6, 1):
             start = datetime(date.year, 5, 31)
@@ -1237,18 +1308,14 @@ class CPVacation(BaseVacation):
         return start, end
 
     @classmethod
-    def check_seniority(cls, userpool):
-        """Called every day to check for user seniority bonus."""
-        cp_bonus = 0
-        # only do this for 'acquis' pool
-        if userpool.pool.name == 'restant':
-            return 0
+    def get_seniority_bonus(cls, pool, seniority):
+        """Return bonus credited on arrival anniversary for a pool.
 
-        user = userpool.user
-        if user.anniversary[0]:
-            cp_bonus = int(math.floor(user.seniority / 5))
-
-        return cp_bonus
+        1 more CP each 5 years of seniority, only for 'acquis' pool.
+        """
+        if pool.name == 'restant':
+            return 0
+        return int(math.floor(seniority / 5))
 
     @classmethod
     def get_acquis(cls, user, starting_date, today=None):
@@ -1314,22 +1381,40 @@ class CPVacation(BaseVacation):
             log.info('user %s is not yet active, discarding' % user.login)
             return
 
+        return cls.walk_cycles(user, today, session,
+                               kwargs.get('start'), kwargs.get('end'))
+
+    @classmethod
+    def get_previous_cycle(cls, user, today, start=None, end=None):
+        """Return usage lookup of previous cycle, None for first cycle."""
+        try:
+            cycle_start, cycle_end = cls.get_cycle_boundaries(today,
+                                                              raising=True)
+        except FirstCycleException:
+            return
+        # lookup of a cycle from itself, user arrived during this cycle
+        if (start == cycle_start) and (end == cycle_end):
+            return
+
+        date = cycle_start
+        # use user arrival_date if after starting cycle date
+        if user.arrival_date > cycle_start:
+            date = user.arrival_date
+        return date, cycle_start, cycle_end
+
+    @classmethod
+    def get_cycle_acquired(cls, user, today, session, previous_usage, first):
+        """Return acquired vacation of a cycle from previous cycle usage."""
         n_1 = 0
         restant = 0
         extra = {}
-        try:
-            start, end = cls.get_cycle_boundaries(today, raising=True)
+        if not first:
+            start, end = cls.get_cycle_boundaries(today)
             cycle_start = start
-            # do not go into a recursive loop if user is in first cycle
-            if (kwargs.get('start') == start) and (kwargs.get('end') == end):
-                raise FirstCycleException()
             # use user arrival_date if after starting cycle date
             if user.arrival_date > start:
                 start = user.arrival_date
             acquis = cls.get_acquis(user, start, today)
-            previous_usage = user.get_cp_usage(session, today=start,
-                                               start=cycle_start, end=end)
-            taken = user.get_cp_taken_cycle(session, start, end)
             restant = previous_usage['acquis']['left']
 
             # only use extra pool for a specific cycle
@@ -1349,7 +1434,7 @@ class CPVacation(BaseVacation):
                     if extra['allowed'] > taken:
                         extra['allowed'] = taken
 
-        except FirstCycleException:
+        else:
             # cannot go back before first cycle, so use current cycle values
             start, end = cls.get_cycle_boundaries(today)
             # use user arrival_date if after starting cycle date
@@ -1471,7 +1556,7 @@ class CPLUVacation(BaseVacation):
         """Retrieve cycle start and end date for given date.
 
         Will raise an exception if raising parameter is passed,
-        this is useful for stopping recursion calls.
+        this is useful for detecting the first cycle.
         """
         start = datetime(date.year, 1, 1)
         end = datetime(date.year, 12, 31)
@@ -1537,15 +1622,31 @@ class CPLUVacation(BaseVacation):
             log.info('user %s is not yet active, discarding' % user.login)
             return
 
-        restant = 0
+        return cls.walk_cycles(user, today, session)
+
+    @classmethod
+    def get_previous_cycle(cls, user, today, start=None, end=None):
+        """Return usage lookup of previous cycle, None for first cycle."""
         try:
-            start, end = cls.get_cycle_boundaries(today, raising=True)
+            start, _ = cls.get_cycle_boundaries(today, raising=True)
+        except FirstCycleException:
+            return
+
+        # use user arrival_date if after starting cycle date
+        if user.arrival_date > start:
+            start = user.arrival_date
+        return start - relativedelta(days=1), None, None
+
+    @classmethod
+    def get_cycle_acquired(cls, user, today, session, previous_usage, first):
+        """Return acquired vacation of a cycle from previous cycle usage."""
+        restant = 0
+        if not first:
+            start, end = cls.get_cycle_boundaries(today)
             # use user arrival_date if after starting cycle date
             if user.arrival_date > start:
                 start = user.arrival_date
             acquis = 200
-            dt = start - relativedelta(days=1)
-            previous_usage = user.get_cp_usage(session, today=dt)
             if not previous_usage:
                 left_acquis = 0
             else:
@@ -1554,7 +1655,7 @@ class CPLUVacation(BaseVacation):
                 if today > previous_usage['acquis']['expire']:
                     left_acquis = 0
             restant = left_acquis
-        except FirstCycleException:
+        else:
             # cannot go back before first cycle, so use current cycle values
             start, end = cls.get_cycle_boundaries(today)
             start = cls.epoch
@@ -1694,16 +1795,37 @@ class Request(Base):
 
     sender_mail = ''
 
+    @declared_attr
+    def __table_args__(cls):  # noqa
+        return (Index('idx_%s_user_id_status_date_from' % cls.__tablename__,
+                      'user_id', 'status', 'date_from'),
+                Index('idx_%s_status_notified' % cls.__tablename__,
+                      'status', 'notified'),
+                Index('idx_%s_date_from_date_to_status' % cls.__tablename__,
+                      'date_from', 'date_to', 'status'),
+                Index('idx_%s_vacation_type_id' % cls.__tablename__,
+                      'vacation_type_id'),
+                {'mysql_engine': 'InnoDB', 'mysql_charset': 'utf8'},
+                )
+
     def update_status(self, status):
         """Reset notified flag when changing status."""
         self.status = status
         self.notified = False
+        self.reset_cp_cache()
 
     def flag_error(self, message, session):
         """ Set request in ERROR and assign message """
         RequestHistory.new(session, self, self.status, 'ERROR')
         self.status = 'ERROR'
         self.error_message = message
+        self.reset_cp_cache()
+
+    def reset_cp_cache(self):
+        """Invalidate user memoized CP usage if this is a CP request."""
+        if self.user and self.vacation_type and \
+                self.vacation_type.name == 'CP':
+            self.user.reset_cp_cache()
 
     def get_admin(self, session):
         if self.status == 'APPROVED_ADMIN' and self.last_action_user_id:
@@ -1752,6 +1874,35 @@ class Request(Base):
                         count=count,
                         order_by=(cls.user_id, cls.date_from.desc()))
 
+    @classmethod
+    def count_visible(cls, session, user, date_to):
+        """Count requests visible by given user ending after date_to.
+
+        Same requests as all_for_admin_per_country for admins or by_manager
+        for managers, along with by_user, but counted in one query.
+        """
+        own = and_(cls.user_id == user.id,
+                   cls.date_from >= datetime.now() - timedelta(days=366))
+        date_limit = datetime.now() - timedelta(days=90)
+        if user.is_admin:
+            visible = or_(own, and_(User.country_id == user.country_id,
+                                    cls.date_from >= date_limit))
+        elif user.is_super:
+            if user.ldap_user:
+                managed = User.manager_dn == user.dn
+            else:
+                managed = User.manager_id == user.id
+            visible = or_(own, and_(managed, cls.date_from >= date_limit))
+        else:
+            visible = own
+
+        return cls.find(session,
+                        join=(cls.user),
+                        where=(cls.status != 'CANCELED',
+                               cls.date_to >= date_to,
+                               visible),
+                        count=cls.id)
+
     @classmethod
     def by_user_future(cls, session, user, count=None):
         """Get requests for given user in the future."""
@@ -1794,6 +1945,20 @@ class Request(Base):
                         count=count,
                         order_by=(cls.user_id, cls.date_from.desc()))
 
+    @classmethod
+    def by_users_approved(cls, session, user_ids, date_from, date_to):
+        """Get approved requests of given users starting between dates.
+
+        retrieve status = APPROVED_ADMIN
+        """
+        return cls.find(session,
+                        where=(cls.user_id.in_(user_ids),
+                               cls.status == 'APPROVED_ADMIN',
+                               cls.date_from >= date_from,
+                               cls.date_from <= date_to,
+                               ),
+                        order_by=(cls.user_id, cls.date_from.desc()))
+
     @classmethod
     def by_user_future_breakdown(cls, session, user, count=None):
         """Get requests for given user in the future.
@@ -1809,6 +1974,34 @@ class Request(Base):
                         count=count,
                         order_by=(cls.user_id, cls.date_from.desc()))
 
+    @classmethod
+    def by_user_type(cls, session, user, name, date_start=None,
+                     date_end=None, year=None, total=False,
+                     status=('PENDING', 'ACCEPTED_MANAGER', 'APPROVED_ADMIN')):
+        """Get requests of a user for a vacation type name.
+
+        Requests must start after date_start, end before date_end, and
+        start in given year. Return the sum of their days if total is set.
+        """
+        filters = (cls.user_id == user.id,
+                   VacationType.name == name,
+                   cls.status.in_(status))
+        if date_start:
+            filters += (cls.date_from >= date_start,)
+        if date_end:
+            filters += (cls.date_to <= date_end,)
+        if year:
+            filters += (cls.date_from >= datetime(year, 1, 1),
+                        cls.date_from < datetime(year + 1, 1, 1))
+
+        if total:
+            taken = session.query(func.sum(cls.days)).\
+                join(cls.vacation_type).filter(*filters).scalar()
+            return taken or 0
+
+        return cls.find(session, join=cls.vacation_type, where=filters,
+                        order_by=cls.id)
+
     @classmethod
     def by_status(cls, session, status, count=None, notified=False):
         """Get requests for given status."""
@@ -1914,6 +2107,59 @@ class Request(Base):
                         order_by=cls.user_id,
                         eagerload=['user'])
 
+    @classmethod
+    def get_index(cls, session, date_from, date_to, where=None):
+        """Get an interval index of requests overlapping given dates.
+
+        CANCELED and DENIED requests are excluded, users are eagerloaded.
+        """
+        where = [cls.date_from <= date_to,
+                 cls.date_to >= date_from,
+                 cls.status != 'CANCELED',
+                 cls.status != 'DENIED'] + list(where or [])
+        return IntervalIndex(cls.find(session,
+                                      join=(cls.user),
+                                      where=where,
+                                      order_by=(cls.user_id, cls.id),
+                                      eagerload=['user']))
+
+    @classmethod
+    def in_conflict_batch(cls, session, requests, ou=False):
+        """Get all requests conflicting on dates with given requests.
+
+        Candidates are retrieved in one query covering the whole date
+        window of given requests, then matched through an interval index.
+
+        if ou is set, only keep conflicts with a common user ou, like
+        in_conflict_ou.
+
+        Return a dict of {request.id: [conflicting requests]}.
+        """
+        conflicts = dict((req.id, []) for req in requests)
+        if not requests:
+            return conflicts
+
+        where = []
+        if ou:
+            ous = set(req.user.ou for req in requests)
+            # keep in_conflict_ou behavior where a null ou matches null ones
+            where.append(or_(User.ou.in_(ous - set([None])),
+                             User.ou.is_(None) if None in ous else False))
+
+        index = cls.get_index(session,
+                              min(req.date_from for req in requests),
+                              max(req.date_to for req in requests),
+                              where)
+        for req in requests:
+            matched = [req2 for req2 in index.overlap(req.date_from,
+                                                      req.date_to)
+                       if req2.id != req.id and
+                       (not ou or req2.user.ou == req.user.ou)]
+            conflicts[req.id] = sorted(matched,
+                                       key=lambda r: (r.user_id, r.id))
+
+        return conflicts
+
     @classmethod
     def get_by_month(cls, session, country, month, year, sage_order=False,
                      first_month_date=None, last_month_date=None):
@@ -2145,15 +2391,12 @@ class Request(Base):
 
         timestamp are in javascript format
         """
-        return [utcify(date)
-                for date in daterange(self.date_from, self.date_to)
-                if date.isoweekday() not in [6, 7]]
+        return [utcify(date) for date in self.dates]
 
     @property
     def dates(self):
         """Return request dates as list."""
-        return [date for date in daterange(self.date_from, self.date_to)
-                if date.isoweekday() not in [6, 7]]
+        return workdays(self.date_from, self.date_to)
 
     def add_to_cal(self, caldav_url, session):
         """
@@ -2256,14 +2499,29 @@ class Sudoer(Base):
     source_id = Column(Integer, nullable=False)
     target_id = Column(Integer, nullable=False)
 
+    # target user ids per source user id, dropped when sudoers change
+    aliases = TTLCache(300)
+
     @classmethod
     def alias(cls, session, user):
         """Retrieve list of aliases for given user."""
-        targets = cls.find(session, where=(cls.source_id == user.id,))
-        if targets:
-            return [User.by_id(session, target.target_id)
-                    for target in targets]
-        return []
+        aliases = []
+
+        def build():
+            aliases.extend(session.query(User).
+                           join(cls, User.id == cls.target_id).
+                           filter(cls.source_id == user.id).
+                           order_by(cls.id).all())
+            return [target.id for target in aliases]
+
+        target_ids = cls.aliases.get(user.id, build)
+        if aliases or not target_ids:
+            return aliases
+
+        targets = dict((target.id, target) for target in
+                       User.find(session, where=(User.id.in_(target_ids),)))
+        return [targets[target_id] for target_id in target_ids
+                if target_id in targets]
 
     @classmethod
     def list(cls, session):
@@ -2271,6 +2529,195 @@ class Sudoer(Base):
         return cls.find(session, order_by=cls.source_id)
 
 
+@event.listens_for(Sudoer, 'after_insert')
+@event.listens_for(Sudoer, 'after_update')
+@event.listens_for(Sudoer, 'after_delete')
+def reset_sudoer_aliases(mapper, connection, target):
+    """Cached aliases must follow sudoer changes, once they are committed.
+
+    Dropping them now would let other requests cache the previous state
+    again before the commit.
+    """
+    session = object_session(target)
+    if session is None:
+        Sudoer.aliases.invalidate()
+    else:
+        session.info['sudoer_aliases_outdated'] = True
+
+
+def flush_sudoer_aliases(session):
+    """Drop aliases changed by the committed transaction."""
+    if session.info.pop('sudoer_aliases_outdated', False):
+        Sudoer.aliases.invalidate()
+
+
+def reset_sudoer_aliases_flag(session, transaction):
+    """Drop aliases left outdated by a rolled back transaction.
+
+    The session may have cached its own uncommitted changes.
+    """
+    if transaction.parent is None:
+        flush_sudoer_aliases(session)
+
+
+SessionFactory.listen('after_commit', flush_sudoer_aliases)
+SessionFactory.listen('after_transaction_end', reset_sudoer_aliases_flag)
+
+
+def reset_off_cache_on_commit(target):
+    """Drop users off now, and again once the change is committed.
+
+    Other requests may cache the previous state in between.
+    """
+    OffCache.invalidate()
+    session = object_session(target)
+    if session is not None:
+        session.info['off_cache_outdated'] = True
+
+
+@event.listens_for(Request.status, 'set')
+def reset_off_cache(target, value, oldvalue, initiator):
+    """Users off depend on requests entering or leaving APPROVED_ADMIN."""
+    if value != oldvalue and 'APPROVED_ADMIN' in (value, oldvalue):
+        reset_off_cache_on_commit(target)
+
+
+@event.listens_for(User.firstname, 'set')
+@event.listens_for(User.lastname, 'set')
+@event.listens_for(User.uid, 'set')
+def reset_off_cache_user(target, value, oldvalue, initiator):
+    """Users off and nicknames are reported by name and nickname."""
+    if value != oldvalue:
+        reset_off_cache_on_commit(target)
+
+
+def flush_off_cache(session):
+    """Drop users off changed by the committed transaction."""
+    if session.info.pop('off_cache_outdated', False):
+        OffCache.invalidate()
+
+
+def reset_off_cache_flag(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('off_cache_outdated', None)
+
+
+SessionFactory.listen('after_commit', flush_off_cache)
+SessionFactory.listen('after_transaction_end', reset_off_cache_flag)
+
+
+class OffCache(object):
+    """Per date cache of users off, used by the off endpoint.
+
+    Entries are dropped when a request status changes from or to
+    APPROVED_ADMIN, or a user name changes, in the current process, and
+    expire after ttl seconds to catch up with changes made by other
+    processes (workers).
+    """
+    cache = TTLCache(60, maxsize=100)
+
+    @classmethod
+    def invalidate(cls):
+        cls.cache.invalidate()
+
+    @classmethod
+    def get_off(cls, session, date=None):
+        """Get users off for given date, default to today's date.
+
+        Return a list of dict with user name, nickname, and request label,
+        days and date_to.
+        """
+        date = date or datetime.now().date()
+        if isinstance(date, datetime):
+            date = date.date()
+
+        def build():
+            return [{'name': req.user.name.lower(),
+                     'nick': req.user.nickname,
+                     'label': req.label,
+                     'days': req.days,
+                     'date_to': req.date_to}
+                    for req in Request.get_active(session, date)]
+
+        return cls.cache.get(('off', date), build)
+
+    @classmethod
+    def get_nicknames(cls, session):
+        """Get all available nicknames, lowercased."""
+        def build():
+            return [nick.lower() for nick in User.get_all_nicknames(session)]
+
+        return cls.cache.get(('nicknames',), build)
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_delete')
+def reset_team_index(mapper, connection, target):
+    """Team members ids must follow users creation and deletion."""
+    TeamIndex.invalidate()
+
+
+@event.listens_for(User.dn, 'set')
+def reset_team_index_dn(target, value, oldvalue, initiator):
+    """Team members are matched on user dn."""
+    if value != oldvalue:
+        TeamIndex.invalidate()
+
+
+class TeamIndex(object):
+    """Inverted index of ldap teams or chapters membership.
+
+    Maps each team to the set of its members user ids, and each user dn
+    to its teams, so team intersections are set operations.
+
+    Indexes are built once from ldap and the user table. They are dropped
+    when users or team members change in the current process, and expire
+    after ttl seconds to catch up with changes made by other processes.
+    """
+    cache = TTLCache(300)
+
+    def __init__(self, groups, users):
+        ids = dict((user_dn, user_id) for user_id, user_dn in users)
+        self.members = {}
+        self.users_teams = {}
+        for team, members in groups.items():
+            self.members[team] = frozenset(ids[member] for member in members
+                                           if member in ids)
+            for member in members:
+                self.users_teams.setdefault(member, []).append(team)
+
+    @property
+    def teams(self):
+        """Return all teams names."""
+        return list(self.members)
+
+    def user_ids(self, team):
+        """Return ids of given team members."""
+        return self.members.get(team, frozenset())
+
+    def common(self, user_dn, other_dn):
+        """Return teams shared by two users."""
+        return (set(self.users_teams.get(user_dn, [])) &
+                set(self.users_teams.get(other_dn, [])))
+
+    @classmethod
+    def invalidate(cls):
+        cls.cache.invalidate()
+
+    @classmethod
+    def get(cls, session, kind='teams'):
+        """Get membership index of ldap teams, or chapters."""
+        def build():
+            ldap = LdapCache()
+            if kind == 'chapters':
+                groups = ldap.list_chapters()
+            else:
+                groups = ldap.list_teams()
+            return cls(groups, session.query(User.id, User.dn))
+
+        return cls.cache.get(kind, build)
+
+
 class Reminder(Base):
     """Describe reminder to send per user/settings.
 
@@ -2417,7 +2864,13 @@ class EventLog(Base):
 
     @classmethod
     def add(cls, session, source, type, comment=None, delta=None,
-            created_at=None, extra_id=None):
+            created_at=None, extra_id=None, flush=False):
+        """Log an event.
+
+        Events are buffered and inserted all at once at commit, or before
+        any query on event logs. Use flush to insert it right away and
+        retrieve the created entry with its id.
+        """
         source_name = source
         if not isinstance(source, str):
             source_name = source.__class__.__name__.lower()
@@ -2434,12 +2887,32 @@ class EventLog(Base):
         if created_at:
             kwargs['created_at'] = created_at
 
+        if not flush:
+            session.info.setdefault('eventlog_buffer', []).append(kwargs)
+            # nothing may be flushed before commit
+            mark_changed(session)
+            return
+
+        cls.flush_buffer(session)
         entry = cls(**kwargs)
         session.add(entry)
         session.flush()
 
         return entry
 
+    @classmethod
+    def flush_buffer(cls, session):
+        """Insert buffered events with one bulk insert."""
+        entries = session.info.pop('eventlog_buffer', None)
+        if entries:
+            session.bulk_insert_mappings(cls, entries)
+
+    @classmethod
+    def build_query(cls, session, *args, **kwargs):
+        # buffered events must be visible to queries
+        cls.flush_buffer(session)
+        return super(EventLog, cls).build_query(session, *args, **kwargs)
+
     @classmethod
     def by_source_type(cls, session, source, type, comment):
         return cls.find(session,
@@ -2455,6 +2928,39 @@ class EventLog(Base):
                                cls.comment == comment),
                         )
 
+    @classmethod
+    def by_pool_type(cls, session, pool, type, comment):
+        """Get events of all userpools of a pool."""
+        userpools = select([UserPool.id]).where(UserPool.pool_id == pool.id)
+        return cls.find(session,
+                        where=(cls.source == 'userpool',
+                               cls.source_id.in_(userpools),
+                               cls.type == type,
+                               cls.comment == comment),
+                        )
+
+    @classmethod
+    def add_pool(cls, session, pool, type, comment, delta, created_at=None):
+        """Log an event for all userpools of a pool with one insert.
+
+        delta is an SQL expression which can use UserPool and User columns.
+        """
+        entries = select([literal('userpool'), UserPool.id, literal(type),
+                          literal(comment), delta,
+                          literal(created_at or datetime.now(), DateTime)]).\
+            select_from(UserPool.__table__.join(User.__table__,
+                                                User.id == UserPool.user_id)).\
+            where(UserPool.pool_id == pool.id)
+        session.execute(cls.__table__.insert().from_select(
+            ['source', 'source_id', 'type', 'comment', 'delta', 'created_at'],
+            entries))
+
+    @classmethod
+    def signed_delta(cls):
+        """SQL expression of delta, negative for decrement events."""
+        return case([(and_(cls.type == 'decrement', cls.delta > 0),
+                      -cls.delta)], else_=cls.delta)
+
     def __repr__(self):
         try:
             return "<EventLog #%d: %s (#%d) -> %s | %s | %s >" % (
@@ -2464,6 +2970,23 @@ class EventLog(Base):
             return object.__repr__(self)
 
 
+def flush_eventlog_buffer(session):
+    """Insert buffered events before commit."""
+    EventLog.flush_buffer(session)
+
+
+def reset_eventlog_buffer(session, transaction):
+    """Drop buffered events when the transaction ends without commit."""
+    if transaction.parent is None:
+        session.info.pop('eventlog_buffer', None)
+
+
+# insert buffered event logs on commit, drop them on rollback, for every
+# session factory including the ones created by scripts
+SessionFactory.listen('before_commit', flush_eventlog_buffer)
+SessionFactory.listen('after_transaction_end', reset_eventlog_buffer)
+
+
 class Pool(Base):
     """Describe a vacation pool entry."""
 
@@ -2487,11 +3010,18 @@ class Pool(Base):
 
     pool_group = Column(Unicode(255), nullable=True)
 
+    # next date the heartbeat has something to do on this pool
+    date_next_due = Column(DateTime, nullable=True)
+
     @declared_attr
     def __table_args__(cls):  # noqa
         return (UniqueConstraint('date_start', 'date_end', 'vacation_type_id',
                                  'country_id', 'name',
                                  name='uq_start_end_type_ctry_name'),
+                Index('idx_%s_status_next_due' % cls.__tablename__,
+                      'status', 'date_next_due'),
+                Index('idx_%s_pool_group' % cls.__tablename__, 'pool_group'),
+                {'mysql_engine': 'InnoDB', 'mysql_charset': 'utf8'},
                 )
 
     @classmethod
@@ -2524,6 +3054,32 @@ class Pool(Base):
             status = [status]
         return cls.find(session, where=(cls.status.in_(status),))
 
+    @classmethod
+    def by_due(cls, session, date, country_id=None):
+        """Get active pools the heartbeat must process at given date."""
+        where = (cls.status == 'active',
+                 or_(cls.date_next_due.is_(None), cls.date_next_due <= date))
+        if country_id:
+            where += (cls.country_id == country_id,)
+        return cls.find(session, where=where)
+
+    def get_next_due(self):
+        """Return next date the heartbeat has something to do on this pool.
+
+        Pool expires the day after its end, and is incremented once a month
+        except for lu.
+        """
+        date_end = self.date_end
+        due = datetime(date_end.year, date_end.month, date_end.day) + \
+            relativedelta(days=1)
+        if self.country and self.country.name == 'lu':
+            return due
+
+        last = self.date_last_increment or datetime.now()
+        increment = datetime(last.year, last.month, 1) + \
+            relativedelta(months=1)
+        return min(due, increment)
+
     @classmethod
     def by_country_active(cls, session, country_id):
         """Get pools for a given name."""
@@ -2598,6 +3154,13 @@ class Pool(Base):
             return object.__repr__(self)
 
 
+@event.listens_for(Pool, 'before_insert')
+@event.listens_for(Pool, 'before_update')
+def update_pool_next_due(mapper, connection, target):
+    """Keep heartbeat watermark in sync with pool dates."""
+    target.date_next_due = target.get_next_due()
+
+
 class UserPool(Base):
     """Describe a user vacation pool entry."""
 
@@ -2612,6 +3175,14 @@ class UserPool(Base):
     pool_id = Column('pool_id', ForeignKey(Pool.id), nullable=False)
     pool = relationship(Pool, backref='user_pools')
 
+    @declared_attr
+    def __table_args__(cls):  # noqa
+        return (Index('idx_%s_user_id_pool_id' % cls.__tablename__,
+                      'user_id', 'pool_id', unique=True),
+                Index('idx_%s_pool_id' % cls.__tablename__, 'pool_id'),
+                {'mysql_engine': 'InnoDB', 'mysql_charset': 'utf8'},
+                )
+
     @classmethod
     def by_user_pool(cls, session, user, pool):
         """Get a userpool for a given user and pool."""
@@ -2634,6 +3205,41 @@ class UserPool(Base):
         """Get all userpools for a given pool."""
         return cls.find(session, where=(cls.pool == pool,))
 
+    @classmethod
+    def compute_balances(cls, session, users, date=None):
+        """Get pool amounts for all given users at once.
+
+        Return a dict of {user_id: {pool fullname: amount}}, computed from
+        active userpools loaded in one query. If a date is given, events
+        logged after it are rolled back using a second query.
+        """
+        user_ids = [user.id for user in users]
+        if not user_ids:
+            return {}
+
+        userpools = session.query(cls).join(cls.pool).\
+            filter(cls.user_id.in_(user_ids), Pool.status == 'active').\
+            options(contains_eager(cls.pool).
+                    joinedload(Pool.vacation_type)).all()
+
+        shifts = {}
+        if date and userpools:
+            EventLog.flush_buffer(session)
+            delta = EventLog.signed_delta()
+            events = session.query(EventLog.source_id, func.sum(delta)).\
+                filter(EventLog.source == 'userpool',
+                       EventLog.source_id.in_([up.id for up in userpools]),
+                       EventLog.type.in_(['increment', 'decrement']),
+                       EventLog.created_at > date).\
+                group_by(EventLog.source_id)
+            shifts = dict(events)
+
+        balances = dict([(user_id, {}) for user_id in user_ids])
+        for up in userpools:
+            amount = up.amount - (shifts.get(up.id) or 0)
+            balances[up.user_id][up.fullname] = amount
+        return balances
+
     @property
     def group_amount(self):
         """Return name of associated pool."""
@@ -2663,10 +3269,20 @@ class UserPool(Base):
         """Return date_end of associated pool."""
         return self.pool.date_end
 
+    def add_event(self, session, type, comment, delta, created_at=None,
+                  extra_id=None):
+        """Log an amount change and report it in balance snapshots."""
+        # event and snapshot boundary must share the same date
+        created_at = created_at or datetime.now()
+        entry = EventLog.add(session, self, type, comment=comment,
+                             delta=delta, created_at=created_at,
+                             extra_id=extra_id)
+        UserPoolSnapshot.update(session, self, type, delta, created_at)
+        return entry
+
     def increment(self, session, amount, comment, created_at=None):
         self.amount = self.amount + amount
-        EventLog.add(session, self, 'increment', comment=comment, delta=amount,
-                     created_at=created_at)
+        self.add_event(session, 'increment', comment, amount, created_at)
 
     def increment_month(self, session, need_increment):
         """Called once per month to increment the user pool amount."""
@@ -2683,23 +3299,94 @@ class UserPool(Base):
 
                 log.debug('incremented user %s -> %s' % (self.user.login, delta)) # noqa
 
-                EventLog.add(session, self, 'increment', comment='heartbeat',
-                             delta=delta)
+                self.add_event(session, 'increment', 'heartbeat', delta)
 
-        # check that we did not have already credited seniority for this user
-        evt = EventLog.by_source_type(session, self, 'increment', 'seniority')
-        if not evt:
-            seniority_bonus = pool_class.check_seniority(self)
-            if seniority_bonus:
-                self.amount = self.amount + seniority_bonus
+        # credit seniority bonus if it is due today and not already done
+        SeniorityScheduler.credit(session, [self])
+
+    @classmethod
+    def increment_pool(cls, session, pool, need_increment):
+        """Increment all userpools of a pool at once.
+
+        Same as calling increment_month on each userpool of the pool, but
+        amounts, event logs and snapshots are updated with a few statements
+        per month whatever the number of users. Increment step can only
+        depend on user partial time.
+        """
+        today = datetime.now()
+        pool_class = pool.vacation_class
+        if need_increment:
+            log.info('pool %r to increment for all users' % pool)
+            months = diff_month(today, pool.date_last_increment)
+            log.info('%d months since last update' % months)
+            # one user of each partial time is enough to compute steps
+            groups = session.query(func.min(User.id), User.partial_time).\
+                join(cls, cls.user_id == User.id).\
+                filter(cls.pool_id == pool.id).\
+                group_by(User.partial_time).all()
+            users = [User.by_id(session, user_id) for user_id, _ in groups]
+            for cpt in range(months):
+                date = pool.date_last_increment + relativedelta(months=cpt + 1) # noqa
+                steps = [(user.partial_time,
+                          pool_class.get_increment_step(user=user, date=date))
+                         for user in users]
+                whens = [(User.partial_time == partial_time, step)
+                         for partial_time, step in steps if partial_time]
+                default = [step for partial_time, step in steps
+                           if not partial_time]
+                default = default[0] if default else 0
+                delta = (case(whens, else_=default) if whens
+                         else literal(default))
+
+                log.debug('incremented pool %r -> %s' % (pool, steps))
+
+                step = select([delta]).where(User.id == cls.user_id)
+                session.query(cls).filter(cls.pool_id == pool.id).\
+                    update({cls.amount: cls.amount + step.as_scalar()},
+                           synchronize_session='fetch')
+                EventLog.add_pool(session, pool, 'increment', 'heartbeat',
+                                  delta, today)
+                UserPoolSnapshot.update_pool(session, pool, 'increment',
+                                             delta, today)
+
+        # credit seniority bonus if it is due today and not already done
+        SeniorityScheduler.credit_pool(session, pool)
+
+    @classmethod
+    def rollover(cls, session, pool, new_pool, amount=None):
+        """Create userpools of a new pool for all users of a pool at once.
+
+        Userpools are credited with given amount, or with their amount in
+        the previous pool, and logged as heartbeat increments.
+        """
+        # amounts are copied in SQL, pending changes must be written first
+        session.flush()
+        today = datetime.now()
+        amount = cls.amount if amount is None else literal(amount)
+        entries = select([amount, cls.user_id, literal(new_pool.id)]).\
+            where(cls.pool_id == pool.id)
+        session.execute(cls.__table__.insert().from_select(
+            ['amount', 'user_id', 'pool_id'], entries))
+        session.expire(new_pool, ['user_pools'])
 
-                EventLog.add(session, self, 'increment', comment='seniority',
-                             delta=seniority_bonus)
+        EventLog.add_pool(session, new_pool, 'increment', 'heartbeat',
+                          cls.amount, today)
+        UserPoolSnapshot.update_pool(session, new_pool, 'increment',
+                                     cls.amount, today)
+
+    @classmethod
+    def round_pool(cls, session, pool):
+        """Round amounts of all userpools of a pool.
+
+        Rounding is done in python, as for a single userpool, since SQL
+        ROUND does not round halves to even.
+        """
+        for userpool in cls.find(session, where=(cls.pool_id == pool.id,)):
+            userpool.amount = round(userpool.amount)
 
     def decrement(self, session, amount, comment, created_at=None):
         self.amount = self.amount - amount
-        EventLog.add(session, self, 'decrement', comment=comment, delta=amount,
-                     created_at=created_at)
+        self.add_event(session, 'decrement', comment, amount, created_at)
 
     @classmethod
     def decrement_request(cls, session, request):
@@ -2741,19 +3428,16 @@ class UserPool(Base):
                         if round(left + delta) == request.days:
                             left = request.days
                     if left:
-                        EventLog.add(session, up, 'decrement', comment=comment,
-                                     delta=left, extra_id=request.id,
-                                     created_at=created_at)
+                        up.add_event(session, 'decrement', comment, left,
+                                     created_at, extra_id=request.id)
                 else:
-                    EventLog.add(session, up, 'decrement', comment=comment,
-                                 delta=delta, extra_id=request.id,
-                                 created_at=created_at)
+                    up.add_event(session, 'decrement', comment, delta,
+                                 created_at, extra_id=request.id)
                     delta = 0
         else:
             userpool.amount = userpool.amount - delta
-            EventLog.add(session, userpool, 'decrement', comment=comment,
-                         delta=delta, extra_id=request.id,
-                         created_at=created_at)
+            userpool.add_event(session, 'decrement', comment, delta,
+                               created_at, extra_id=request.id)
 
     @classmethod
     def increment_request(cls, session, request):
@@ -2763,12 +3447,11 @@ class UserPool(Base):
         # for each events, rollback/refund the userpool
         # this way if a request has consumed multiple pools, it will refund
         # each one for the correct amount
-        for event in events:
-            up = UserPool.by_id(session, event.source_id)
-            up.amount = up.amount + event.delta
-            EventLog.add(session, up, 'increment', comment=comment,
-                         delta=event.delta, extra_id=request.id,
-                         created_at=request.date_from)
+        for evt in events:
+            up = UserPool.by_id(session, evt.source_id)
+            up.amount = up.amount + evt.delta
+            up.add_event(session, 'increment', comment, evt.delta,
+                         request.date_from, extra_id=request.id)
 
     def get_pool_history(self, session, user):
         """Return all events for a userpool."""
@@ -2801,6 +3484,345 @@ class UserPool(Base):
             return object.__repr__(self)
 
 
+class UserPoolSnapshot(Base):
+    """Store userpool balance at month boundaries.
+
+    Balance is the sum of userpool events logged before the snapshot date,
+    which is always the first day of a month.
+    """
+
+    userpool_id = Column('userpool_id', ForeignKey(UserPool.id),
+                         nullable=False)
+    userpool = relationship(UserPool,
+                            backref=backref('snapshots',
+                                            cascade='all,delete'))
+    date = Column(DateTime, nullable=False)
+    amount = Column(Float(precision=2), nullable=False)
+
+    @declared_attr
+    def __table_args__(cls):  # noqa
+        return (UniqueConstraint('userpool_id', 'date',
+                                 name='uq_userpool_date'),
+                {'mysql_engine': 'InnoDB', 'mysql_charset': 'utf8'},
+                )
+
+    @classmethod
+    def get_boundary(cls, date):
+        """Return first month boundary after given date."""
+        return datetime(date.year, date.month, 1) + relativedelta(months=1)
+
+    @classmethod
+    def by_userpool_date(cls, session, userpool, date):
+        """Get latest snapshot of a userpool at given date."""
+        return cls.first(session,
+                         where=(cls.userpool_id == userpool.id,
+                                cls.date <= date),
+                         order_by=cls.date.desc())
+
+    @classmethod
+    def update(cls, session, userpool, type, delta, created_at=None):
+        """Report a userpool event in all following month boundaries.
+
+        Deltas are summed per userpool and boundary in a session buffer,
+        applied at commit or before any query on snapshots.
+        """
+        if not delta:
+            return
+        if type == 'decrement' and delta > 0:
+            delta = -delta
+
+        key = (userpool.id, cls.get_boundary(created_at or datetime.now()))
+        deltas = session.info.setdefault('snapshot_buffer', {})
+        deltas[key] = deltas.get(key, 0) + delta
+        mark_changed(session)
+
+    @classmethod
+    def flush_buffer(cls, session):
+        """Apply buffered deltas, creating missing boundary snapshots."""
+        deltas = session.info.pop('snapshot_buffer', None)
+        if not deltas:
+            return
+
+        userpool_ids = set(userpool_id for userpool_id, _ in deltas)
+        snapshots = {}
+        for userpool_id, date, amount in \
+                session.query(cls.userpool_id, cls.date, cls.amount).\
+                filter(cls.userpool_id.in_(userpool_ids)):
+            snapshots.setdefault(userpool_id, {})[date] = amount
+
+        missing = []
+        for userpool_id, boundary in sorted(deltas):
+            amounts = snapshots.setdefault(userpool_id, {})
+            if boundary in amounts:
+                continue
+            previous = [date for date in amounts if date < boundary]
+            amount = amounts[max(previous)] if previous else 0
+            amounts[boundary] = amount
+            missing.append({'userpool_id': userpool_id, 'date': boundary,
+                            'amount': amount})
+        if missing:
+            session.bulk_insert_mappings(cls, missing)
+
+        for (userpool_id, boundary), delta in deltas.items():
+            if not delta:
+                continue
+            session.query(cls).\
+                filter(cls.userpool_id == userpool_id,
+                       cls.date >= boundary).\
+                update({cls.amount: cls.amount + delta},
+                       synchronize_session='evaluate')
+
+    @classmethod
+    def build_query(cls, session, *args, **kwargs):
+        # buffered deltas must be visible to queries
+        cls.flush_buffer(session)
+        return super(UserPoolSnapshot, cls).build_query(session, *args,
+                                                         **kwargs)
+
+    @classmethod
+    def update_pool(cls, session, pool, type, delta, created_at=None):
+        """Report an event of all userpools of a pool in month boundaries.
+
+        Same as update for each userpool of the pool, delta is an SQL
+        expression which can use UserPool and User columns.
+        """
+        if type == 'decrement':
+            delta = -func.abs(delta)
+        cls.flush_buffer(session)
+        boundary = cls.get_boundary(created_at or datetime.now())
+        userpools = UserPool.__table__.join(User.__table__,
+                                            User.id == UserPool.user_id)
+
+        # create missing boundary snapshots from the previous ones
+        previous = select([cls.amount]).\
+            where(and_(cls.userpool_id == UserPool.id, cls.date < boundary)).\
+            order_by(cls.date.desc()).limit(1).as_scalar()
+        existing = exists().where(and_(cls.userpool_id == UserPool.id,
+                                       cls.date == boundary))
+        missing = select([UserPool.id, literal(boundary, DateTime),
+                          func.coalesce(previous, 0)]).\
+            select_from(userpools).\
+            where(and_(UserPool.pool_id == pool.id, delta != 0, ~existing))
+        session.execute(cls.__table__.insert().from_select(
+            ['userpool_id', 'date', 'amount'], missing))
+
+        step = select([delta]).select_from(userpools).\
+            where(UserPool.id == cls.userpool_id)
+        session.query(cls).\
+            filter(cls.userpool_id.in_(select([UserPool.id]).
+                                       where(UserPool.pool_id == pool.id)),
+                   cls.date >= boundary).\
+            update({cls.amount: cls.amount + step.as_scalar()},
+                   synchronize_session='fetch')
+
+    @classmethod
+    def rebuild(cls, session, userpool):
+        """Compute again all snapshots of a userpool from its events."""
+        cls.flush_buffer(session)
+        session.query(cls).filter(cls.userpool_id == userpool.id).\
+            delete(synchronize_session='fetch')
+        events = EventLog.find(session,
+                               where=(EventLog.source == 'userpool',
+                                      EventLog.source_id == userpool.id,
+                                      EventLog.type.in_(['increment',
+                                                         'decrement'])),
+                               order_by=(EventLog.created_at, EventLog.id))
+        amounts = {}
+        total = 0
+        for evt in events:
+            delta = evt.delta or 0
+            if evt.type == 'decrement' and delta > 0:
+                delta = -delta
+            total += delta
+            amounts[cls.get_boundary(evt.created_at)] = total
+
+        for date, amount in sorted(amounts.items()):
+            session.add(cls(userpool_id=userpool.id, date=date,
+                            amount=amount))
+        session.flush()
+
+    def __repr__(self):
+        try:
+            return "<UserPoolSnapshot #%d: %s | %s>" % (self.userpool_id,
+                                                       self.date,
+                                                       self.amount)
+        except:
+            return object.__repr__(self)
+
+
+def flush_snapshot_buffer(session):
+    """Apply buffered snapshot deltas before commit."""
+    UserPoolSnapshot.flush_buffer(session)
+
+
+def reset_snapshot_buffer(session, transaction):
+    """Drop buffered snapshot deltas when the transaction ends."""
+    if transaction.parent is None:
+        session.info.pop('snapshot_buffer', None)
+
+
+SessionFactory.listen('before_commit', flush_snapshot_buffer)
+SessionFactory.listen('after_transaction_end', reset_snapshot_buffer)
+
+
+class SeniorityScheduler(object):
+    """Credit seniority bonus of userpools on arrival anniversaries.
+
+    Arrival dates of all users are loaded once a day, with one ldap search
+    per country, and indexed by anniversary. Userpools which already got
+    their bonus are indexed from event logs, so a day without anniversary
+    needs no lookup at all.
+
+    Indexes are class attributes, so they live as long as the worker
+    process and are shared by all its tasks. They are only dropped by
+    reset, when crediting a country fails, or rebuilt by load on the
+    first call of a new day.
+    """
+
+    day = None
+    # arrival date of users having their anniversary this day, by user id
+    anniversaries = {}
+    # ids of userpools already credited
+    credited = set()
+
+    @classmethod
+    def reset(cls):
+        """Drop indexes, they will be built again on next use."""
+        cls.day = None
+        cls.anniversaries = {}
+        cls.credited = set()
+
+    @classmethod
+    def is_anniversary(cls, arrival, today):
+        """Return whether today is the arrival anniversary.
+
+        Arrivals on February 29 are celebrated on February 28 of non leap
+        years, as relativedelta does when adding years.
+        """
+        anniversary = arrival + relativedelta(years=today.year - arrival.year)
+        return (anniversary.month, anniversary.day) == (today.month, today.day)
+
+    @classmethod
+    def load(cls, session, today):
+        """Build indexes for given day if not already done."""
+        if cls.day == today.date():
+            return
+
+        arrivals = dict(session.query(User.id, User.created_at).
+                        filter(~User.ldap_user))
+        ldap_users = session.query(User.id, User.dn, Countries.name).\
+            join(User._country).filter(User.ldap_user).all()
+        if ldap_users:
+            ldap = LdapCache()
+            for country in set([name for _, _, name in ldap_users]):
+                dates = ldap.list_arrivals_country(country)
+                for user_id, dn, name in ldap_users:
+                    if name == country:
+                        arrivals[user_id] = dates.get(dn)
+
+        cls.anniversaries = dict([(user_id, arrival)
+                                  for user_id, arrival in arrivals.items()
+                                  if arrival and arrival <= today and
+                                  cls.is_anniversary(arrival, today)])
+
+        EventLog.flush_buffer(session)
+        credited = session.query(EventLog.source_id).\
+            filter(EventLog.source == 'userpool',
+                   EventLog.type == 'increment',
+                   EventLog.comment == 'seniority')
+        cls.credited = set([source_id for source_id, in credited])
+        cls.day = today.date()
+
+    @classmethod
+    def refresh_credited(cls, session, userpools):
+        """Update credited index for given userpools from event logs.
+
+        Index may be outdated when bonus was credited by another process.
+        """
+        EventLog.flush_buffer(session)
+        credited = session.query(EventLog.source_id).\
+            filter(EventLog.source == 'userpool',
+                   EventLog.source_id.in_([up.id for up in userpools]),
+                   EventLog.type == 'increment',
+                   EventLog.comment == 'seniority')
+        cls.credited.update([source_id for source_id, in credited])
+
+    @classmethod
+    def credit(cls, session, userpools, today=None):
+        """Credit seniority bonus of given userpools if due today."""
+        today = today or datetime.now()
+        cls.load(session, today)
+        userpools = [up for up in userpools
+                     if up.user_id in cls.anniversaries and
+                     up.id not in cls.credited]
+        if not userpools:
+            return
+        cls.refresh_credited(session, userpools)
+        for up in userpools:
+            if up.id in cls.credited:
+                continue
+            seniority = today.year - cls.anniversaries[up.user_id].year
+            pool_class = up.pool.vacation_class
+            seniority_bonus = pool_class.get_seniority_bonus(up.pool,
+                                                             seniority)
+            if seniority_bonus:
+                up.amount = up.amount + seniority_bonus
+
+                up.add_event(session, 'increment', 'seniority',
+                             seniority_bonus)
+                cls.credited.add(up.id)
+
+    @classmethod
+    def due_countries(cls, session, today=None):
+        """Return ids of countries having a seniority bonus due today.
+
+        Credited userpools are read from event logs, as they are credited
+        by country workers, not by the calling process.
+        """
+        today = today or datetime.now()
+        cls.load(session, today)
+        if not cls.anniversaries:
+            return set()
+        EventLog.flush_buffer(session)
+        credited = exists().where(and_(EventLog.source == 'userpool',
+                                       EventLog.source_id == UserPool.id,
+                                       EventLog.type == 'increment',
+                                       EventLog.comment == 'seniority'))
+        countries = session.query(Pool.country_id).distinct().\
+            select_from(UserPool).join(UserPool.pool).\
+            filter(Pool.status == 'active',
+                   UserPool.user_id.in_(list(cls.anniversaries)),
+                   ~credited)
+        return set([country_id for country_id, in countries])
+
+    @classmethod
+    def credit_due(cls, session, today=None, country_id=None):
+        """Credit seniority bonus of all active userpools if due today."""
+        today = today or datetime.now()
+        cls.load(session, today)
+        if not cls.anniversaries:
+            return
+        where = (Pool.status == 'active',
+                 UserPool.user_id.in_(list(cls.anniversaries)))
+        if country_id:
+            where += (Pool.country_id == country_id,)
+        userpools = UserPool.find(session, join=UserPool.pool, where=where)
+        cls.credit(session, userpools, today)
+
+    @classmethod
+    def credit_pool(cls, session, pool, today=None):
+        """Credit seniority bonus of all userpools of a pool if due today."""
+        today = today or datetime.now()
+        cls.load(session, today)
+        if not cls.anniversaries:
+            return
+        userpools = UserPool.find(session,
+                                  where=(UserPool.pool_id == pool.id,
+                                         UserPool.user_id.in_(
+                                             list(cls.anniversaries))))
+        cls.credit(session, userpools, today)
+
+
 def includeme(config):
     """
     Pyramid includeme file for the :class:`pyramid.config.Configurator`
@@ -2850,3 +3872,6 @@ def includeme(config):
 
     if 'pyvac.password.sender.mail' in settings:
         Request.sender_mail = settings['pyvac.password.sender.mail']
+
+    if 'pyvac.off_cache_ttl' in settings:
+        OffCache.cache.ttl = int(settings['pyvac.off_cache_ttl'])
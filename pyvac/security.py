@@ -6,23 +6,60 @@ see http://docs.pylonsproject.org/projects/pyramid/en/latest/tutorials/wiki2/aut
 
 import logging
 from pyramid.security import Allow
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 
 from .models import DBSession, User, Group
+from .helpers.cache import TTLCache
+from .helpers.sqla import SessionFactory
 
 log = logging.getLogger(__name__)
 
 
+def get_user(request):
+    """
+    Return the user authenticated for the given request.
+
+    Registered as the reified ``request.user`` property, so the user is
+    loaded once per request and shared by views, groupfinder and locale
+    negotiation.
+
+    :param request: pyramid request
+    :type login: :class:`pyramid.request.Request`
+
+    :return: authenticated user or None
+    :rtype: :class:`pyvac.models.User`
+    """
+    login = request.unauthenticated_userid
+    if login:
+        return User.by_login(DBSession(), login)
+
+
 class GroupFinder(object):
     """
     Method creator of :meth:`groupfinder`
+
+    Groups are cached per login in a bounded LRU, or in redis to share them
+    between workers. Entries are dropped once user groups changes are
+    committed, and expire after ttl seconds to catch up with changes made
+    by other processes when the cache is not shared.
     """
-    _users = {}
+    cache = TTLCache(300, maxsize=1000)
 
     def reset(self):
         """
         Reset the cache of users groups.
         """
-        self._users = {}
+        self.cache.invalidate()
+
+    def invalidate(self, login):
+        """
+        Drop cached groups of given user.
+
+        :param login: user login
+        :type login: unicode
+        """
+        self.cache.invalidate(login)
 
     def __call__(self, login, request):
         """
@@ -35,20 +72,66 @@ class GroupFinder(object):
         :return: list of groups name.
         :rtype: list of unicode
         """
-        if login in self._users:
-            return self._users[login]
+        def build():
+            # reuse the request user when it is the one we are looking for
+            user = getattr(request, 'user', None)
+            if user is None or user.login != login:
+                user = User.by_login(DBSession(), login)
+            if user:
+                return [g.name for g in user.groups]
+            return []
 
-        user = User.by_login(DBSession(), login)
-        if user:
-            rv = [g.name for g in user.groups]
-        else:
-            rv = []
-        self._users[login] = rv
-        return rv
+        return self.cache.get(login, build)
 
 groupfinder = GroupFinder()
 
 
+def reset_user_groups_on_commit(target, login):
+    """Drop cached groups of a login once the change is committed.
+
+    Dropping them now would let other requests cache the previous groups
+    again before the commit.
+    """
+    session = object_session(target)
+    if session is None:
+        groupfinder.invalidate(login)
+    else:
+        session.info.setdefault('groups_outdated', set()).add(login)
+
+
+@event.listens_for(User.groups, 'append')
+@event.listens_for(User.groups, 'remove')
+def reset_user_groups(target, value, initiator):
+    """Cached groups must follow account edits and LDAP sync."""
+    reset_user_groups_on_commit(target, target.login)
+
+
+@event.listens_for(User.login, 'set')
+def reset_user_login(target, value, oldvalue, initiator):
+    """A renamed user must not keep groups cached under its old login."""
+    if value != oldvalue and isinstance(oldvalue, str):
+        reset_user_groups_on_commit(target, oldvalue)
+
+
+def flush_user_groups(session):
+    """Drop cached groups changed by the committed transaction."""
+    for login in session.info.pop('groups_outdated', ()):
+        groupfinder.invalidate(login)
+
+
+def reset_user_groups_flag(session, transaction):
+    """Drop groups left outdated by a rolled back transaction.
+
+    The session may have cached its own uncommitted changes.
+    """
+    if transaction.parent is None:
+        flush_user_groups(session)
+
+
+SessionFactory.listen('after_commit', flush_user_groups)
+SessionFactory.listen('after_transaction_end', reset_user_groups_flag)
+
+
 class RootFactory(object):
     """
     Pyramid root factory that contains the ACL.
@@ -3,7 +3,7 @@ import sys
 import yaml
 
 from celery.signals import worker_process_init
-from pyvac.helpers.sqla import create_engine
+from pyvac.models import create_engine
 from pyvac.helpers.ldap import LdapCache
 from pyvac.helpers.mail import SmtpCache
 from pyvac.helpers.conf import ConfCache
@@ -21,8 +21,7 @@ def configure_workers(sender=None, conf=None, **kwargs):
     with open(sys.argv[1]) as fdesc:
         conf = yaml.load(fdesc, YAMLLoader)
     # XXX Register the database
-    create_engine('pyvac', conf.get('databases').get('pyvac'),
-                  scoped=True)
+    create_engine(conf.get('databases').get('pyvac'), scoped=True)
     if conf.get('ldap'):
         LdapCache.configure(conf.get('ldap').get('conf'))
     SmtpCache.configure(conf.get('smtp'))
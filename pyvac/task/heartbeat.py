@@ -6,9 +6,14 @@ import transaction
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
-from celery.task import Task
+import redis
+from redis.exceptions import LockError
+from celery import chord
+from celery.task import Task, subtask
 
-from pyvac.models import DBSession, Pool, UserPool
+from pyvac.models import DBSession, Pool, UserPool, SeniorityScheduler
+from pyvac.helpers.sqla import SessionFactory
+from pyvac.helpers.conf import ConfCache
 
 
 log = logging.getLogger(__name__)
@@ -22,16 +27,21 @@ class HeartBeat(Task):
       * only one time per month
       * take account of seniority if it applies
       * take account of partial time if it applies
+
+    Work is dispatched to one HeartBeatCountry task per country having
+    something due, so countries are processed in parallel.
     """
     name = 'heart_beat'
+    # increment all user pools of a pool with a few sql statements
+    bulk = False
 
-    def process_pool_cycle(self, session):
+    def process_pool_cycle(self, session, country_id=None):
         """Disable expired pool, create new ones."""
         today = datetime.now().replace(hour=0, minute=0, second=0,
                                        microsecond=0)
         # handle pools cycle expiration
-        active_pools = Pool.by_status(session, 'active')
-        self.log.debug('found %d active pool' % len(active_pools))
+        active_pools = Pool.by_due(session, datetime.now(), country_id)
+        self.log.debug('found %d due pool' % len(active_pools))
         for pool in active_pools:
             if today > pool.date_end:
                 self.log.info('pool %r must expire: %s' % (pool, pool.date_end)) # noqa
@@ -61,25 +71,36 @@ class HeartBeat(Task):
                     acquis.date_last_increment = yesterday
                     # switch current amounts from old acquis to new restant
                     # and grant initial amount for new cycle
-                    for up in acquis.user_pools:
-                        # need to increment one last time the acquis pool
-                        # before expiring it, as we acquire CP after a full
-                        # worked month not at the start of month like RTT
+                    if self.bulk:
+                        # same as below with a few sql statements per pool
                         if pool.country.name == 'fr':
-                            up.increment_month(session, True)
-                            up.amount = round(up.amount)
-
-                        self.log.debug('user:%s amount:%s' % (up.user.name, up.amount)) # noqa
-                        entry = UserPool(amount=0, user=up.user, pool=new_restant) # noqa
-                        session.flush()
-                        entry.increment(session, up.amount, 'heartbeat')
-                        entry = UserPool(amount=0, user=up.user, pool=new_acquis) # noqa
-                        session.flush()
-                        # don't increment acquis after creation for fr
-                        if pool.country.name != 'fr':
-                            entry.increment(session, initial_amount, 'heartbeat') # noqa
-                        else:
-                            entry.increment(session, 0, 'heartbeat') # noqa
+                            UserPool.increment_pool(session, acquis, True)
+                            UserPool.round_pool(session, acquis)
+                            # don't increment acquis after creation for fr
+                            initial_amount = 0
+                        UserPool.rollover(session, acquis, new_restant)
+                        UserPool.rollover(session, acquis, new_acquis,
+                                          initial_amount)
+                    else:
+                        for up in acquis.user_pools:
+                            # need to increment one last time the acquis pool
+                            # before expiring it, as we acquire CP after a full
+                            # worked month not at the start of month like RTT
+                            if pool.country.name == 'fr':
+                                up.increment_month(session, True)
+                                up.amount = round(up.amount)
+
+                            self.log.debug('user:%s amount:%s' % (up.user.name, up.amount)) # noqa
+                            entry = UserPool(amount=0, user=up.user, pool=new_restant) # noqa
+                            session.flush()
+                            entry.increment(session, up.amount, 'heartbeat')
+                            entry = UserPool(amount=0, user=up.user, pool=new_acquis) # noqa
+                            session.flush()
+                            # don't increment acquis after creation for fr
+                            if pool.country.name != 'fr':
+                                entry.increment(session, initial_amount, 'heartbeat') # noqa
+                            else:
+                                entry.increment(session, 0, 'heartbeat') # noqa
 
                     restant.expire(session)
                     acquis.expire(session)
@@ -88,17 +109,21 @@ class HeartBeat(Task):
                     new_pool = Pool.clone(session, pool, shift=12)
                     pool_class = pool.vacation_class
                     initial_amount = pool_class.get_increment_step()
-                    for up in pool.user_pools:
-                        entry = UserPool(amount=0, user=up.user, pool=new_pool) # noqa
-                        session.flush()
-                        entry.increment(session, initial_amount, 'heartbeat')
+                    if self.bulk:
+                        UserPool.rollover(session, pool, new_pool,
+                                          initial_amount)
+                    else:
+                        for up in pool.user_pools:
+                            entry = UserPool(amount=0, user=up.user, pool=new_pool) # noqa
+                            session.flush()
+                            entry.increment(session, initial_amount, 'heartbeat') # noqa
                     pool.expire(session)
 
-    def process_pool_increment(self, session):
+    def process_pool_increment(self, session, country_id=None):
         """Increment user pools amount"""
         today = datetime.now()
-        active_pools = Pool.by_status(session, 'active')
-        self.log.debug('found %d active pool' % len(active_pools))
+        active_pools = Pool.by_due(session, today, country_id)
+        self.log.debug('found %d due pool' % len(active_pools))
         for pool in active_pools:
             need_increment = True
             # do we need to increment this pool ?
@@ -122,23 +147,126 @@ class HeartBeat(Task):
                 acquis = [p for p in all_pools if p.name == 'acquis'][0]
                 pool_to_inc = acquis
 
-            for up in pool_to_inc.user_pools:
-                up.increment_month(session, need_increment)
+            if self.bulk:
+                UserPool.increment_pool(session, pool_to_inc, need_increment)
+            else:
+                for up in pool_to_inc.user_pools:
+                    up.increment_month(session, need_increment)
 
             if need_increment:
                 pool_to_inc.date_last_increment = today
 
+    def process_seniority(self, session, country_id=None):
+        """Credit seniority bonus of users having their anniversary."""
+        SeniorityScheduler.credit_due(session, country_id=country_id)
+
+    def close_session(self):
+        """Release the worker thread database session."""
+        SessionFactory.get('pyvac').remove()
+
     def run(self, *args, **kwargs):
         self.log = log
         # init database connection
         session = DBSession()
 
-        # process pool life cycle
-        self.process_pool_cycle(session)
-        # process user pool increment
-        self.process_pool_increment(session)
+        try:
+            # process pools of each country in parallel
+            pools = Pool.by_due(session, datetime.now())
+            countries = set([pool.country_id for pool in pools])
+            countries.update(SeniorityScheduler.due_countries(session))
+            transaction.commit()
+        except Exception:
+            transaction.abort()
+            raise
+        finally:
+            self.close_session()
+
+        if not countries:
+            self.log.debug('nothing to do')
+            return True
+
+        self.log.info('%d due pools, processing countries %r' %
+                      (len(pools), sorted(countries)))
+        tasks = [subtask(HeartBeatCountry, kwargs={'country_id': country})
+                 for country in sorted(countries)]
+        async_result = chord(tasks)(subtask(HeartBeatReport))
+        self.log.info('task scheduled %r' % async_result)
+
+        return True
+
 
-        session.flush()
-        transaction.commit()
+class HeartBeatCountry(HeartBeat):
+    """Process due pools of a country.
 
+    A lock stored in redis prevents two workers from processing the same
+    country at the same time.
+    """
+    name = 'heart_beat_country'
+    # seconds after which the lock is released if the worker died
+    lock_timeout = 3600
+
+    def get_lock(self, conf, country_id):
+        """Return redis lock of the country."""
+        url = conf.get('heartbeat', {}).get('lock_url',
+                                            self.app.conf.broker_url)
+        client = redis.StrictRedis.from_url(url)
+        return client.lock('pyvac:heart_beat:%s' % country_id,
+                           timeout=self.lock_timeout)
+
+    def run(self, country_id, *args, **kwargs):
+        self.log = log
+        # init conf
+        conf = ConfCache()
+        self.bulk = conf.get('heartbeat', {}).get('bulk', False)
+
+        lock = self.get_lock(conf, country_id)
+        if not lock.acquire(blocking=False):
+            self.log.info('country %s already processed elsewhere' %
+                          country_id)
+            return {'country_id': country_id, 'processed': False}
+
+        try:
+            # init database connection
+            session = DBSession()
+            try:
+                # process pool life cycle
+                self.process_pool_cycle(session, country_id)
+                # process user pool increment
+                self.process_pool_increment(session, country_id)
+                # process user seniority bonus
+                self.process_seniority(session, country_id)
+
+                session.flush()
+            except Exception:
+                self.log.exception('Error while processing pools')
+                # never commit a partial pools rollover
+                transaction.abort()
+                SeniorityScheduler.reset()
+                raise
+            else:
+                transaction.commit()
+            finally:
+                self.close_session()
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                # lock expired while processing, do not hide the outcome
+                self.log.warning('lock of country %s expired after %ds' %
+                                 (country_id, self.lock_timeout))
+
+        return {'country_id': country_id, 'processed': True}
+
+
+class HeartBeatReport(Task):
+    """Log the outcome of heartbeat country tasks."""
+    name = 'heart_beat_report'
+
+    def run(self, results, *args, **kwargs):
+        self.log = log
+        processed = [res['country_id'] for res in results if res['processed']]
+        skipped = [res['country_id'] for res in results
+                   if not res['processed']]
+        self.log.info('heartbeat processed countries %r, skipped %r' %
+                      (processed, skipped))
         return True
@@ -9,6 +9,7 @@ except ImportError:
 import transaction
 from webob.multidict import MultiDict
 from pyramid import testing
+from pyramid.decorator import reify
 from pyramid.httpexceptions import HTTPFound
 # from pyramid.authorization import ACLAuthorizationPolicy
 
@@ -43,6 +44,12 @@ class DummyRequest(testing.DummyRequest):
 
     translate = auto_translate
 
+    @reify
+    def user(self):
+        # mirror the request method added in pyvac configuration
+        from pyvac.security import get_user
+        return get_user(self)
+
 
 class UnauthenticatedViewTestCase(TestCase):
 
@@ -221,6 +221,94 @@ class RequestTestCase(ModelTestCase):
         nb_conflicts = Request.in_conflict(self.session, req, count=True)
         self.assertEqual(nb_conflicts, 1)
 
+    def test_in_conflict_batch(self):
+        from pyvac.models import Request
+        requests = [Request.by_id(self.session, req_id)
+                    for req_id in (1, 3, 6)]
+        conflicts = Request.in_conflict_batch(self.session, requests)
+        self.assertEqual(dict((req_id, sorted(req.id for req in reqs))
+                              for req_id, reqs in conflicts.items()),
+                         {1: [2], 3: [5], 6: []})
+        conflicts = Request.in_conflict_batch(self.session, requests,
+                                              ou=True)
+        self.assertEqual(len(conflicts[1]), 1)
+
+    def test_by_users_approved(self):
+        from pyvac.models import Request, User
+        user1 = User.by_login(self.session, 'jdoe')
+        user2 = User.by_login(self.session, 'janedoe')
+        requests = Request.by_users_approved(self.session,
+                                             [user1.id, user2.id],
+                                             datetime(2016, 1, 1),
+                                             datetime(2016, 6, 6))
+        self.assertEqual([(req.user.login, req.date_from)
+                          for req in requests],
+                         [('jdoe', datetime(2016, 6, 6)),
+                          ('jdoe', datetime(2016, 6, 1)),
+                          ('jdoe', datetime(2016, 2, 1))])
+
+    def test_get_index(self):
+        from pyvac.models import Request
+        index = Request.get_index(self.session, datetime(2015, 4, 1),
+                                  datetime(2015, 4, 30))
+        # canceled and denied requests are not indexed
+        self.assertEqual(sorted(req.id for req in index), [1, 2, 3, 5])
+        overlap = index.overlap(datetime(2015, 4, 15),
+                                datetime(2015, 4, 24))
+        self.assertEqual(sorted(req.id for req in overlap), [2, 3, 5])
+        self.assertEqual(index.overlap(datetime(2015, 4, 22),
+                                       datetime(2015, 4, 23)), [])
+        self.assertEqual(index.users_off(datetime(2015, 4, 14)), set([5, 6]))
+
+    def test_count_visible(self):
+        from pyvac.models import Request, User
+        with freeze_time('2015-03-01',
+                         ignore=['celery', 'psycopg2', 'sqlalchemy',
+                                 'icalendar']):
+            for login in ('admin', 'manager1', 'jdoe'):
+                user = User.by_login(self.session, login)
+                requests = Request.by_user(self.session, user)
+                if user.is_admin:
+                    requests += Request.all_for_admin_per_country(
+                        self.session, user.country)
+                elif user.is_super:
+                    requests += Request.by_manager(self.session, user)
+                today = datetime(2015, 4, 1)
+                expected = len(set([req.id for req in requests
+                                    if req.date_to >= today]))
+                self.assertEqual(Request.count_visible(self.session, user,
+                                                       today), expected)
+
+    def test_off_cache(self):
+        from pyvac.models import OffCache, Request
+        OffCache.invalidate()
+        date = datetime(2015, 4, 25)
+        offs = OffCache.get_off(self.session, date)
+        self.assertEqual([off['name'] for off in offs], ['third manager'])
+        with patch('pyvac.models.Request.get_active') as mock_active:
+            self.assertEqual(OffCache.get_off(self.session, date), offs)
+            self.assertFalse(mock_active.called)
+
+        req = Request.by_id(self.session, 3)
+        req.update_status('APPROVED_ADMIN')
+        self.assertEqual(len(OffCache.cache), 0)
+        self.session.flush()
+        offs = OffCache.get_off(self.session, date)
+        self.assertEqual(len(offs), 2)
+        req.update_status('ACCEPTED_MANAGER')
+        req.notified = True
+        self.session.flush()
+        self.assertEqual(len(OffCache.cache), 0)
+        # dates are normalized, and renaming a user drops entries
+        OffCache.get_off(self.session, date)
+        self.assertIn(('off', date.date()), OffCache.cache)
+        firstname = req.user.firstname
+        req.user.firstname = 'renamed'
+        self.assertEqual(len(OffCache.cache), 0)
+        self.assertTrue(self.session.info['off_cache_outdated'])
+        req.user.firstname = firstname
+        self.session.flush()
+
     def test_get_by_month(self):
         from pyvac.models import Request
         month = 8
@@ -346,6 +434,36 @@ class CPVacationTestCase(ModelTestCase):
             self.assertEqual(to_recover, [datetime(2016, 12, 25, 0, 0),
                                           datetime(2017, 1, 1, 0, 0)])
 
+    def test_holiday_calendar_cache(self):
+        from pyvac.models import User
+        from pyvac.helpers.holiday import calendars, get_holiday
+        user = User.by_login(self.session, 'sarah.doe')
+        calendars.invalidate()
+        holidays = get_holiday(user, year=2016, use_datetime=True)
+        self.assertIsInstance(holidays, frozenset)
+        self.assertIn(datetime(2016, 12, 25), holidays)
+        self.assertIn(datetime(2017, 1, 1), holidays)
+        self.assertIn(('lu', 2016), calendars)
+        self.assertIn(('lu', 2017), calendars)
+        with patch('pyvac.helpers.holiday.conv_table', {}):
+            self.assertEqual(get_holiday(user, year=2016, use_datetime=True),
+                             holidays)
+            self.assertEqual(len(get_holiday(user, year=2016)),
+                             len(holidays))
+
+    def test_workdays(self):
+        from pyvac.helpers.holiday import workdays
+        date_from = datetime(2016, 12, 23)
+        date_to = datetime(2017, 1, 3)
+        self.assertEqual(len(workdays(date_from, date_to)), 8)
+        # boxing day is a holiday in luxembourg, christmas and new year
+        # fall on a sunday
+        self.assertEqual(workdays(date_from, date_to, 'lu'),
+                         [datetime(2016, 12, 23), datetime(2016, 12, 27),
+                          datetime(2016, 12, 28), datetime(2016, 12, 29),
+                          datetime(2016, 12, 30), datetime(2017, 1, 2),
+                          datetime(2017, 1, 3)])
+
     def test_lu_validate_request(self):
         from pyvac.models import CPLUVacation, CompensatoireVacation, User
 
@@ -570,6 +688,71 @@ class CPVacationTestCase(ModelTestCase):
                 msg = 'CP can only be used until %s.' % user.pool['CP acquis'].date_end.strftime('%d/%m/%Y') # noqa
                 self.assertEqual(err, msg)
 
+    def test_cp_usage_memoized(self):
+        from pyvac.models import CPVacation, Request, User
+
+        with patch('pyvac.models.User.arrival_date',
+                   new_callable=PropertyMock) as mock_foo, \
+                patch.object(CPVacation, 'epoch', datetime(2014, 6, 1)):
+            mock_foo.return_value = datetime(2014, 1, 1)
+            user = User.by_login(self.session, 'jdoe')
+            today = datetime(2015, 5, 1)
+            usage = user.get_cp_usage(self.session, today=today)
+            self.assertEqual(usage['taken'], 5)
+            self.assertIn((today, None, None, None), user.cp_cache)
+            # returned values must be safe to alter
+            usage['taken'] = 0
+            usage = user.get_cp_usage(self.session, today=today)
+            self.assertEqual(usage['taken'], 5)
+
+            req = Request.by_id(self.session, 1)
+            req.update_status('CANCELED')
+            self.assertEqual(user.cp_cache, {})
+            usage = user.get_cp_usage(self.session, today=today)
+            self.assertEqual(usage['taken'], 0)
+            # current time is not memoized, only past cycles are
+            user.get_cp_usage(self.session)
+            size = len(user.cp_cache)
+            user.get_cp_usage(self.session)
+            self.assertEqual(len(user.cp_cache), size)
+            # restore fixture
+            req.status = 'PENDING'
+            req.notified = False
+            user.reset_cp_cache()
+            self.session.flush()
+
+
+class TeamIndexTestCase(ModelTestCase):
+
+    def test_team_index(self):
+        from pyvac.models import TeamIndex
+        index = TeamIndex({'dev': ['cn=jdoe', 'cn=janedoe', 'cn=ghost'],
+                           'ops': ['cn=janedoe']},
+                          [(1, 'cn=jdoe'), (2, 'cn=janedoe')])
+        self.assertEqual(sorted(index.teams), ['dev', 'ops'])
+        self.assertEqual(index.user_ids('dev'), frozenset([1, 2]))
+        self.assertEqual(index.user_ids('ops'), frozenset([2]))
+        self.assertEqual(index.user_ids('unknown'), frozenset())
+        self.assertEqual(sorted(index.users_teams['cn=janedoe']),
+                         ['dev', 'ops'])
+        self.assertEqual(index.users_teams['cn=ghost'], ['dev'])
+        self.assertEqual(index.common('cn=jdoe', 'cn=janedoe'),
+                         set(['dev']))
+        self.assertEqual(index.common('cn=jdoe', 'cn=nobody'), set())
+
+    def test_team_index_cache(self):
+        from pyvac.models import TeamIndex
+        TeamIndex.invalidate()
+        with patch('pyvac.models.LdapCache') as mock_ldap:
+            mock_ldap.return_value.list_teams.return_value = {'dev': []}
+            index = TeamIndex.get(self.session)
+            self.assertIs(TeamIndex.get(self.session), index)
+            self.assertEqual(mock_ldap.return_value.list_teams.call_count,
+                             1)
+            TeamIndex.invalidate()
+            self.assertIsNot(TeamIndex.get(self.session), index)
+        TeamIndex.invalidate()
+
 
 class SudoerTestCase(ModelTestCase):
 
@@ -601,3 +784,324 @@ class SudoerTestCase(ModelTestCase):
 
         sudoers = Sudoer.alias(self.session, user)
         self.assertEqual(sudoers, [])
+
+    def test_alias_cache(self):
+        from pyvac.models import Sudoer, flush_sudoer_aliases
+        from pyvac.models import User
+        user = User.by_login(self.session, 'jdoe')
+        Sudoer.aliases.invalidate()
+        self.assertEqual(Sudoer.alias(self.session, user), [])
+        self.assertIn(user.id, Sudoer.aliases)
+        with patch('pyvac.models.User.find') as mock_find:
+            self.assertEqual(Sudoer.alias(self.session, user), [])
+            self.assertFalse(mock_find.called)
+
+        sudoer = Sudoer(source_id=user.id, target_id=1)
+        self.session.add(sudoer)
+        self.session.flush()
+        # aliases are dropped once the change is committed
+        self.assertIn(user.id, Sudoer.aliases)
+        flush_sudoer_aliases(self.session)
+        self.assertNotIn(user.id, Sudoer.aliases)
+        sudoers = Sudoer.alias(self.session, user)
+        self.assertEqual([target.id for target in sudoers], [1])
+        self.assertEqual([target.id for target in
+                          Sudoer.alias(self.session, user)], [1])
+        self.session.delete(sudoer)
+        self.session.flush()
+        self.assertTrue(self.session.info['sudoer_aliases_outdated'])
+        flush_sudoer_aliases(self.session)
+        self.assertNotIn(user.id, Sudoer.aliases)
+
+
+class EventLogTestCase(ModelTestCase):
+
+    def test_add_buffered(self):
+        import transaction
+        from pyvac.models import EventLog, User
+        user = User.by_login(self.session, 'jdoe')
+        entry = EventLog.add(self.session, user, 'status', comment='buffered')
+        self.assertIsNone(entry)
+        self.assertEqual(len(self.session.info['eventlog_buffer']), 1)
+        # buffered events are inserted before querying event logs
+        events = EventLog.by_type_comment(self.session, 'status', 'buffered')
+        self.assertEqual(len(events), 1)
+        self.assertNotIn('eventlog_buffer', self.session.info)
+
+        entry = EventLog.add(self.session, user, 'status', comment='buffered',
+                             flush=True)
+        self.assertIsInstance(entry, EventLog)
+        self.assertTrue(entry.id)
+        transaction.abort()
+
+    def test_buffer_listeners_registered(self):
+        from pyvac.helpers.sqla import SessionFactory
+        from pyvac.models import EventLog, User
+        # factories registered outside models.create_engine, like scripts
+        factory = SessionFactory.register('pyvac_script', False,
+                                          self.session.bind)
+        try:
+            session = factory()
+            user = User.by_login(session, 'jdoe')
+            EventLog.add(session, user, 'status', comment='script')
+            self.assertIn('eventlog_buffer', session.info)
+            session.rollback()
+            self.assertNotIn('eventlog_buffer', session.info)
+            session.close()
+        finally:
+            del SessionFactory.sessions['pyvac_script']
+
+
+class PoolTestCase(ModelTestCase):
+
+    def test_next_due(self):
+        import transaction
+        from pyvac.models import Countries, Pool, VacationType
+        vacation_type = VacationType.by_name(self.session, 'CP')
+        pools = [Pool(name='acquis', date_start=datetime(2016, 6, 1),
+                      date_end=datetime(2017, 5, 31), status='active',
+                      date_last_increment=datetime(2016, 9, 1),
+                      vacation_type=vacation_type,
+                      country=Countries.by_name(self.session, country))
+                 for country in ('fr', 'lu')]
+        self.session.add_all(pools)
+        self.session.flush()
+        self.assertEqual(pools[0].date_next_due, datetime(2016, 10, 1))
+        # lu pools are never incremented
+        self.assertEqual(pools[1].date_next_due, datetime(2017, 6, 1))
+
+        due = Pool.by_due(self.session, datetime(2016, 10, 1))
+        self.assertIn(pools[0], due)
+        self.assertNotIn(pools[1], due)
+
+        pools[0].date_last_increment = datetime(2017, 5, 1)
+        self.session.flush()
+        self.assertEqual(pools[0].date_next_due, datetime(2017, 6, 1))
+        # restore fixture
+        for pool in pools:
+            self.session.delete(pool)
+        self.session.flush()
+        transaction.abort()
+
+
+class UserPoolTestCase(ModelTestCase):
+
+    def delete_userpools(self, ids, pool_ids=()):
+        """Delete userpools and their history without cascading on users"""
+        from pyvac.models import EventLog, Pool, UserPool, UserPoolSnapshot
+        self.session.query(EventLog).\
+            filter(EventLog.source == 'userpool',
+                   EventLog.source_id.in_(ids)).\
+            delete(synchronize_session=False)
+        self.session.query(UserPoolSnapshot).\
+            filter(UserPoolSnapshot.userpool_id.in_(ids)).\
+            delete(synchronize_session=False)
+        self.session.query(UserPool).filter(UserPool.id.in_(ids)).\
+            delete(synchronize_session=False)
+        if pool_ids:
+            self.session.query(Pool).filter(Pool.id.in_(pool_ids)).\
+                delete(synchronize_session=False)
+        self.session.expunge_all()
+        self.session.flush()
+
+    def test_compute_balances(self):
+        import transaction
+        from pyvac.models import Pool, User, UserPool
+        user = User.by_login(self.session, 'jdoe')
+        user2 = User.by_login(self.session, 'janedoe')
+        pool = Pool.by_name_country(self.session, 'RTT', user._country)
+        userpool = UserPool(amount=0, user=user, pool=pool)
+        self.session.add(userpool)
+        self.session.flush()
+        userpool.increment(self.session, 5, 'heartbeat',
+                           created_at=datetime(2016, 1, 1))
+        userpool.decrement(self.session, 2, 'Request #1',
+                           created_at=datetime(2016, 3, 1))
+
+        balances = UserPool.compute_balances(self.session, [user, user2])
+        self.assertEqual(balances, {user.id: {'RTT': 3}, user2.id: {}})
+        balances = UserPool.compute_balances(self.session, [user],
+                                             datetime(2016, 2, 1))
+        self.assertEqual(balances, {user.id: {'RTT': 5}})
+        self.delete_userpools([userpool.id])
+        transaction.abort()
+
+    def test_balance_snapshots(self):
+        import transaction
+        from pyvac.models import Pool, User, UserPool, UserPoolSnapshot
+        user = User.by_login(self.session, 'jdoe')
+        pool = Pool.by_name_country(self.session, 'RTT', user._country)
+        userpool = UserPool(amount=0, user=user, pool=pool)
+        self.session.add(userpool)
+        self.session.flush()
+        userpool.increment(self.session, 5, 'heartbeat',
+                           created_at=datetime(2016, 1, 1))
+        userpool.increment(self.session, 1, 'heartbeat',
+                           created_at=datetime(2016, 3, 10))
+        userpool.decrement(self.session, 2, 'Request #1',
+                           created_at=datetime(2016, 1, 15))
+        # deltas are summed per month boundary until snapshots are queried
+        self.assertEqual(self.session.info['snapshot_buffer'],
+                         {(userpool.id, datetime(2016, 2, 1)): 3,
+                          (userpool.id, datetime(2016, 4, 1)): 1})
+
+        def snapshots():
+            return [(snap.date, snap.amount) for snap in
+                    UserPoolSnapshot.find(self.session,
+                                          where=(UserPoolSnapshot.userpool_id == userpool.id,), # noqa
+                                          order_by=UserPoolSnapshot.date)]
+
+        expected = [(datetime(2016, 2, 1), 3), (datetime(2016, 4, 1), 4)]
+        self.assertEqual(snapshots(), expected)
+        UserPoolSnapshot.rebuild(self.session, userpool)
+        self.assertEqual(snapshots(), expected)
+
+        self.delete_userpools([userpool.id])
+        transaction.abort()
+
+    def test_increment_pool(self):
+        import transaction
+        from pyvac.models import (EventLog, Pool, User, UserPool,
+                                  UserPoolSnapshot)
+        user = User.by_login(self.session, 'jdoe')
+        user2 = User.by_login(self.session, 'janedoe')
+        user2.partial_time = '4/5'
+        rtt = Pool.by_name_country(self.session, 'RTT', user._country)
+        pool = Pool(name='RTT', date_start=datetime(2016, 1, 1),
+                    date_end=datetime(2016, 12, 31), status='inactive',
+                    date_last_increment=datetime(2016, 1, 1),
+                    vacation_type=rtt.vacation_type, country=rtt.country)
+        self.session.add(pool)
+        userpool = UserPool(amount=0, user=user, pool=pool)
+        userpool2 = UserPool(amount=1, user=user2, pool=pool)
+        self.session.add_all([userpool, userpool2])
+        self.session.flush()
+        with freeze_time('2016-04-15',
+                         ignore=['celery', 'psycopg2', 'sqlalchemy',
+                                 'icalendar']):
+            UserPool.increment_pool(self.session, pool, True)
+        self.assertEqual(userpool.amount, 3)
+        self.assertAlmostEqual(userpool2.amount, 3.4)
+        events = EventLog.by_pool_type(self.session, pool, 'increment',
+                                       'heartbeat')
+        self.assertEqual(sorted([(evt.source_id, evt.delta)
+                                 for evt in events]),
+                         [(userpool.id, 1)] * 3 + [(userpool2.id, 0.8)] * 3)
+        snapshot = UserPoolSnapshot.by_userpool_date(self.session, userpool2,
+                                                     datetime(2016, 5, 1))
+        self.assertEqual(snapshot.date, datetime(2016, 5, 1))
+        self.assertAlmostEqual(snapshot.amount, 2.4)
+        self.delete_userpools([userpool.id, userpool2.id], [pool.id])
+        user2 = User.by_login(self.session, 'janedoe')
+        user2.partial_time = None
+        self.session.flush()
+        transaction.abort()
+
+    def test_rollover(self):
+        import transaction
+        from pyvac.models import (EventLog, Pool, User, UserPool,
+                                  UserPoolSnapshot)
+        user = User.by_login(self.session, 'jdoe')
+        user2 = User.by_login(self.session, 'janedoe')
+        rtt = Pool.by_name_country(self.session, 'RTT', user._country)
+        pools = [Pool(name='RTT', date_start=datetime(year, 1, 1),
+                      date_end=datetime(year, 12, 31), status='inactive',
+                      vacation_type=rtt.vacation_type, country=rtt.country)
+                 for year in (2016, 2017, 2018)]
+        self.session.add_all(pools)
+        self.session.add_all([UserPool(amount=3, user=user, pool=pools[0]),
+                              UserPool(amount=1.5, user=user2,
+                                       pool=pools[0])])
+        self.session.flush()
+        with freeze_time('2017-01-01',
+                         ignore=['celery', 'psycopg2', 'sqlalchemy',
+                                 'icalendar']):
+            UserPool.rollover(self.session, pools[0], pools[1])
+            UserPool.rollover(self.session, pools[0], pools[2], 2)
+
+        amounts = sorted([(up.user_id, up.amount)
+                          for up in pools[1].user_pools])
+        self.assertEqual(amounts, [(user.id, 3), (user2.id, 1.5)])
+        amounts = sorted([(up.user_id, up.amount)
+                          for up in pools[2].user_pools])
+        self.assertEqual(amounts, [(user.id, 2), (user2.id, 2)])
+        events = EventLog.by_pool_type(self.session, pools[1], 'increment',
+                                       'heartbeat')
+        self.assertEqual(sorted([evt.delta for evt in events]), [1.5, 3])
+        userpool = UserPool.by_user_pool_id(self.session, user.id,
+                                            pools[1].id)
+        snapshot = UserPoolSnapshot.by_userpool_date(self.session, userpool,
+                                                     datetime(2017, 2, 1))
+        self.assertEqual(snapshot.amount, 3)
+        # halves are rounded to even, as for a single userpool
+        userpool2 = UserPool.by_user_pool_id(self.session, user2.id,
+                                             pools[0].id)
+        userpool2.amount = 2.5
+        UserPool.round_pool(self.session, pools[0])
+        self.assertEqual(userpool2.amount, 2)
+        self.delete_userpools([up.id for pool in pools
+                               for up in pool.user_pools],
+                              [pool.id for pool in pools])
+        transaction.abort()
+
+    def test_rollover_rounded(self):
+        import transaction
+        from pyvac.models import Pool, User, UserPool
+        user = User.by_login(self.session, 'jdoe')
+        rtt = Pool.by_name_country(self.session, 'RTT', user._country)
+        pools = [Pool(name='RTT', date_start=datetime(year, 1, 1),
+                      date_end=datetime(year, 12, 31), status='inactive',
+                      vacation_type=rtt.vacation_type, country=rtt.country)
+                 for year in (2016, 2017)]
+        self.session.add_all(pools)
+        self.session.add(UserPool(amount=3.4, user=user, pool=pools[0]))
+        self.session.flush()
+        # rounded amounts not yet flushed must be the ones copied
+        UserPool.round_pool(self.session, pools[0])
+        UserPool.rollover(self.session, pools[0], pools[1])
+        self.assertEqual([up.amount for up in pools[1].user_pools], [3])
+        self.delete_userpools([up.id for pool in pools
+                               for up in pool.user_pools],
+                              [pool.id for pool in pools])
+        transaction.abort()
+
+    def test_seniority_scheduler(self):
+        import transaction
+        from pyvac.models import (EventLog, Pool, SeniorityScheduler, User,
+                                  UserPool, VacationType)
+        user = User.by_login(self.session, 'jdoe')
+        pool = Pool(name='acquis', date_start=datetime(2016, 6, 1),
+                    date_end=datetime(2017, 5, 31), status='inactive',
+                    vacation_type=VacationType.by_name(self.session, 'CP'),
+                    country=user._country)
+        userpool = UserPool(amount=3, user=user, pool=pool)
+        self.session.add_all([pool, userpool])
+        self.session.flush()
+        today = user.created_at + relativedelta(years=10)
+        SeniorityScheduler.reset()
+        SeniorityScheduler.credit_pool(self.session, pool, today)
+        self.assertEqual(SeniorityScheduler.anniversaries[user.id],
+                         user.created_at)
+        self.assertEqual(userpool.amount, 5)
+        events = EventLog.by_source_type(self.session, userpool, 'increment',
+                                         'seniority')
+        self.assertEqual([evt.delta for evt in events], [2])
+        # only credited once
+        SeniorityScheduler.credit(self.session, [userpool], today)
+        self.assertEqual(userpool.amount, 5)
+        # nothing is due the day after
+        SeniorityScheduler.credit(self.session, [userpool],
+                                  today + relativedelta(days=1))
+        self.assertNotIn(user.id, SeniorityScheduler.anniversaries)
+        self.delete_userpools([userpool.id], [pool.id])
+        SeniorityScheduler.reset()
+        transaction.abort()
+
+    def test_seniority_leap_day(self):
+        from pyvac.models import SeniorityScheduler
+        arrival = datetime(2012, 2, 29)
+        is_anniversary = SeniorityScheduler.is_anniversary
+        self.assertTrue(is_anniversary(arrival, datetime(2017, 2, 28)))
+        self.assertFalse(is_anniversary(arrival, datetime(2017, 3, 1)))
+        self.assertTrue(is_anniversary(arrival, datetime(2016, 2, 29)))
+        self.assertFalse(is_anniversary(arrival, datetime(2016, 2, 28)))
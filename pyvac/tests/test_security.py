@@ -35,3 +35,76 @@ class GroupFinderTestCase(UnauthenticatedViewTestCase):
         from pyvac.security import groupfinder
         self.assertEqual(set(groupfinder('jdoe', self.create_request())),
                          set(['user']))
+
+    def test_request_user_groups(self):
+        from mock import patch
+        from pyvac.security import GroupFinder
+        self.config.testing_securitypolicy(userid='manager2')
+        request = self.create_request()
+        self.assertEqual(request.user.login, 'manager2')
+        finder = GroupFinder()
+        finder.reset()
+        with patch('pyvac.models.User.by_login') as mock_by_login:
+            self.assertEqual(finder('manager2', request), ['manager'])
+            self.assertFalse(mock_by_login.called)
+
+    def test_groups_cache_invalidated(self):
+        from pyvac.models import Group, User
+        from pyvac.security import groupfinder, flush_user_groups
+        groupfinder.reset()
+        request = self.create_request()
+        self.assertEqual(groupfinder('jdoe', request), ['user'])
+        self.assertIn('jdoe', groupfinder.cache)
+        user = User.by_login(self.session, 'jdoe')
+        manager = Group.by_name(self.session, 'manager')
+        user.groups.append(manager)
+        # groups are dropped once the change is committed
+        self.assertIn('jdoe', groupfinder.cache)
+        self.assertEqual(self.session.info['groups_outdated'], set(['jdoe']))
+        flush_user_groups(self.session)
+        self.assertNotIn('jdoe', groupfinder.cache)
+        user.groups.remove(manager)
+        self.session.flush()
+        flush_user_groups(self.session)
+        self.assertNotIn('jdoe', groupfinder.cache)
+
+    def test_groups_cache_shared(self):
+        from fnmatch import fnmatch
+        from mock import patch
+        from redis.exceptions import ConnectionError
+        from pyvac.helpers.cache import RedisCache
+        from pyvac.security import GroupFinder
+
+        class Client(dict):
+            def exists(self, key):
+                return key in self
+
+            def setex(self, key, ttl, value):
+                self[key] = value
+
+            def delete(self, *keys):
+                for key in keys:
+                    self.pop(key, None)
+
+            def scan_iter(self, match):
+                return [key for key in self if fnmatch(key, match)]
+
+        client = Client()
+        cache = RedisCache(client, 'pyvac:groups:', 300)
+        request = self.create_request()
+        with patch.object(GroupFinder, 'cache', cache):
+            # another worker sees what was cached and invalidated here
+            worker1, worker2 = GroupFinder(), GroupFinder()
+            self.assertEqual(worker1('jdoe', request), ['user'])
+            self.assertIn('pyvac:groups:jdoe', client)
+            with patch('pyvac.models.User.by_login') as mock_by_login:
+                self.assertEqual(worker2('jdoe', request), ['user'])
+                self.assertFalse(mock_by_login.called)
+            worker1.invalidate('jdoe')
+            self.assertNotIn('jdoe', worker2.cache)
+            worker2('jdoe', request)
+            worker1.reset()
+            self.assertEqual(client, {})
+            # redis being down must not prevent authentication
+            with patch.object(Client, 'get', side_effect=ConnectionError):
+                self.assertEqual(worker1('jdoe', request), ['user'])
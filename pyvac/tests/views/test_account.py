@@ -170,3 +170,37 @@ class AccountTestCase(case.ViewTestCase):
         account = User.by_id(self.session, self.account_id)
         self.assertIsNone(account)
         self.account_todelete = []
+
+    def test_get_photo_ok(self):
+        import shutil
+        import tempfile
+        from mock import patch
+        from pyvac.views.account import Photo
+        from pyvac.models import User
+        account = User.by_id(self.session, self.account_id)
+        account.ldap_user = True
+        account.dn = 'cn=%s,c=fr,dc=example,dc=net' % self.account_login
+        self.session.flush()
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with patch.object(Photo, 'cache_dir', cache_dir), \
+                    patch('pyvac.views.account.LdapCache') as ldap:
+                ldap.return_value.get_user_photo.return_value = b'jpeg'
+                request = self.create_request(
+                    matchdict={'user_id': self.account_id})
+                view = Photo(request)()
+                self.assertEqual(view.body, b'jpeg')
+                self.assertEqual(view.content_type, 'image/jpeg')
+                self.assertTrue(view.etag)
+                self.assertFalse(view.cache_control.public)
+                # served from disk cache on next hit
+                view = Photo(request)()
+                self.assertEqual(view.body, b'jpeg')
+                self.assertEqual(ldap.return_value.get_user_photo.call_count,
+                                 1)
+                Photo.invalidate(account)
+                ldap.return_value.get_user_photo.return_value = None
+                view = Photo(request)()
+                self.assertEqual(view.status_int, 404)
+        finally:
+            shutil.rmtree(cache_dir)
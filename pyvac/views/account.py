@@ -1,20 +1,31 @@
 # -*- coding: utf-8 -*-
 import re
+import time
 import base64
+import hashlib
 import os.path
 import logging
+import tempfile
+from io import BytesIO
 from datetime import datetime
 
 import unidecode
+from webob import Response
 from pyramid.settings import asbool
-from pyramid.httpexceptions import HTTPFound
+from pyramid.httpexceptions import HTTPFound, HTTPNotFound
 from pyramid.url import route_url
 
+try:
+    from PIL import Image
+except ImportError:
+    # thumbnails are not resized without Pillow
+    Image = None
+
 from .base import View, CreateView, EditView, DeleteView
 
 from pyvac.models import (
     User, Group, Countries, Pool, UserPool, Request, RequestHistory,
-    EventLog,
+    TeamIndex,
 )
 from pyvac.helpers.i18n import trans as _
 from pyvac.helpers.ldap import (
@@ -50,10 +61,7 @@ class List(View):
             ldap = LdapCache()
 
             user_attr = ldap.get_users_units()
-            users_teams = {}
-            for team, members in list(ldap.list_teams().items()):
-                for member in members:
-                    users_teams.setdefault(member, []).append(team)
+            users_teams = TeamIndex.get(self.session).users_teams
 
             active_users = ldap.list_active_users()
 
@@ -83,11 +91,12 @@ class ListPool(View):
         data = []
         rtt_usage = {}
         cp_usage = {}
+        balances = UserPool.compute_balances(self.session, users)
         for user in users:
             if user.login in self.ignore_users:
                 continue
 
-            usage = dict([(k, v.amount) for k, v in list(user.pool.items())])
+            usage = balances[user.id]
             rtt_usage[user.login] = usage.get('RTT', 0)
             cp_total = usage.get('CP acquis', 0) + usage.get('CP restant', 0)
             cp_usage[user.login] = cp_total
@@ -148,12 +157,10 @@ class AccountMixin:
             view['managers'] = ldap.list_manager()
             view['units'] = ldap.list_ou()
 
-            view['teams'] = ldap.list_teams()
-            uteams = {}
-            for team, members in list(view['teams'].items()):
-                for member in members:
-                    uteams.setdefault(member, []).append(team)
-            view['user_teams'] = uteams.get(view['ldap_user'].get('dn'), [])
+            team_index = TeamIndex.get(self.session)
+            view['teams'] = team_index.teams
+            view['user_teams'] = team_index.users_teams.get(
+                view['ldap_user'].get('dn'), [])
 
             # generate a random password for the user, he must change it later
             password = randomstring()
@@ -253,8 +260,7 @@ This has no effect on CP acquisition.
                         log.info('%s update %s: %s -> %s' %
                                  (self.user.login, up, up.amount, new))
                         up.amount = new
-                        EventLog.add(self.session, up, shift,
-                                     comment=comment, delta=delta)
+                        up.add_event(self.session, shift, comment, delta)
                 except Exception as exc:
                     msg = 'cannot update %s: %s' % (up, exc)
                     log.error(msg)
@@ -410,17 +416,18 @@ class Edit(AccountMixin, EditView):
                 ldap.update_user(account, password=password, unit=unit,
                                  arrival_date=arrival_date, uid=uid,
                                  photo=photo, mobile=mobile)
+                if photo is not None:
+                    Photo.invalidate(account)
             except UnknownLdapUser:
                 pass
 
             # only for admins
             if self.user.is_admin:
-                # update teams
-                uteams = {}
-                for team, members in list(ldap.list_teams().items()):
-                    for member in members:
-                        uteams.setdefault(member, []).append(team)
-                user_teams = uteams.get(account.dn, [])
+                # update teams, read from ldap as the shared index is only
+                # meant for display and may be outdated
+                user_teams = [team for team, members
+                              in list(ldap.list_teams().items())
+                              if account.dn in members]
 
                 # add to new teams
                 for team in r.params.getall('teams'):
@@ -437,6 +444,8 @@ class Edit(AccountMixin, EditView):
                             members.remove(account.dn)
                         ldap.update_team(team, members)
 
+                TeamIndex.invalidate()
+
                 # update role for user in LDAP
                 old_role = account.role
                 if 'ldap_role' in r.params:
@@ -601,17 +610,15 @@ class Whoswho(View):
             # synchronise user groups/roles
             # User.sync_ldap_info(self.session)
             ldap = LdapCache()
-            ldap_users = ldap.list_users()
+            ldap_users = ldap.list_users(photo=False)
 
             # discard users which should be deleted
             users = [user for user in users
                      if user.dn in ldap_users]
 
-            teams = ldap.list_teams()
-            data['teams'] = list(teams.keys())
-            for team, members in list(teams.items()):
-                for member in members:
-                    users_teams.setdefault(member, []).append(team)
+            team_index = TeamIndex.get(self.session)
+            data['teams'] = team_index.teams
+            users_teams = team_index.users_teams
 
         return_json = self.return_json()
         for user in users:
@@ -628,11 +635,8 @@ class Whoswho(View):
             if use_ldap:
                 ldap_user = ldap_users[user.dn]
                 if not return_json:
-                    jpeg = ldap_user.get('jpegPhoto')
-                    photo = None
-                    if jpeg:
-                        photo = base64.b64encode(jpeg)
-                    item['photo'] = photo
+                    item['photo'] = route_url('user_photo', self.request,
+                                              user_id=user.id)
                 item['mobile'] = ldap_user.get('mobile', '-')
 
             data['users'].append(item)
@@ -640,6 +644,79 @@ class Whoswho(View):
         return {'data': data}
 
 
+class Photo(View):
+    """
+    Serve user photo thumbnail from LDAP, cached on disk
+    """
+    cache_dir = os.path.join(tempfile.gettempdir(), 'pyvac_photos')
+    # seconds before checking LDAP again for a photo
+    max_age = 86400
+    size = 200
+
+    @classmethod
+    def cache_path(cls, user):
+        key = hashlib.sha1(user.dn.encode('utf-8')).hexdigest()
+        return os.path.join(cls.cache_dir, '%s_%d.jpg' % (key, cls.size))
+
+    @classmethod
+    def invalidate(cls, user):
+        """Remove cached thumbnail of user, when its photo changes."""
+        try:
+            os.remove(cls.cache_path(user))
+        except OSError:
+            pass
+
+    @classmethod
+    def thumbnail(cls, photo):
+        if not Image:
+            return photo
+        try:
+            img = Image.open(BytesIO(photo))
+            img.thumbnail((cls.size, cls.size))
+            output = BytesIO()
+            img.convert('RGB').save(output, 'JPEG', quality=85)
+            return output.getvalue()
+        except Exception:
+            log.warning('cannot resize photo, serving original')
+            return photo
+
+    def get_photo(self, user):
+        """Return thumbnail of user photo, empty if user has none."""
+        path = self.cache_path(user)
+        if (os.path.isfile(path) and
+                time.time() - os.path.getmtime(path) < self.max_age):
+            with open(path, 'rb') as fdesc:
+                return fdesc.read()
+
+        photo = LdapCache().get_user_photo(user.dn)
+        photo = self.thumbnail(photo) if photo else b''
+        # also cache missing photos so LDAP is not queried on each hit
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp_path = '%s.%d' % (path, os.getpid())
+        with open(tmp_path, 'wb') as fdesc:
+            fdesc.write(photo)
+        os.rename(tmp_path, path)
+        return photo
+
+    def render(self):
+        user = User.by_id(self.session, int(self.request.matchdict['user_id']))
+        if not user or not user.ldap_user:
+            return HTTPNotFound()
+
+        photo = self.get_photo(user)
+        if not photo:
+            return HTTPNotFound()
+
+        response = Response(body=photo, content_type='image/jpeg',
+                            conditional_response=True)
+        response.etag = hashlib.sha1(photo).hexdigest()
+        # browser cache only, shared proxies must not keep employee photos
+        response.cache_control.private = True
+        response.cache_control.max_age = self.max_age
+        return response
+
+
 def includeme(config):
     """
     Pyramid includeme file for the :class:`pyramid.config.Configurator`
@@ -652,6 +729,9 @@ def includeme(config):
         Whoswho.ignore_users = ignore_users
         log.info('Loaded ListPool ignore_users: %s' % ListPool.ignore_users)
 
+    if 'pyvac.photo_cache_dir' in settings:
+        Photo.cache_dir = settings['pyvac.photo_cache_dir']
+
     if 'pyvac.override_who_template' in settings:
         filename = settings['pyvac.override_who_template']
         # only set this if file exists, to avoid errors
@@ -9,6 +9,7 @@ from pyramid.httpexceptions import HTTPFound
 from pyramid.url import route_url
 # from pyramid.response import Response
 from pyramid.settings import asbool
+from sqlalchemy.orm import object_session
 
 from pyvac.helpers.sqla import ModelError
 
@@ -31,7 +32,10 @@ class ViewBase(object):
 
         if login:
             self.login = login
-            self.user = User.by_login(self.session, login)
+            self.user = self.request.user
+            if self.user and object_session(self.user) is not self.session:
+                # unscoped sessions do not share the request user
+                self.user = User.by_login(self.session, login)
         else:
             self.login = 'anonymous'
             self.user = None
@@ -81,29 +85,13 @@ class View(ViewBase):
 
             if self.user:
                 # if logged, retrieve total requests count for header
-                req_list = {'requests': []}
-                requests = []
-                if self.user.is_admin:
-                    country = self.user.country
-                    requests = Request.all_for_admin_per_country(self.session,
-                                                                 country)
-                elif self.user.is_super:
-                    requests = Request.by_manager(self.session, self.user)
-
-                req_list['requests'] = requests
-
-                # always add our requests
-                for req in Request.by_user(self.session, self.user):
-                    if req not in req_list['requests']:
-                        req_list['requests'].append(req)
-
                 # only count next requests
                 today = datetime.now()
                 if self.user.is_admin:
                     # for admin, display request from 1st of month
                     today = today.replace(day=1)
-                requests_count = len([req for req in req_list['requests']
-                                      if req.date_to >= today])
+                requests_count = Request.count_visible(self.session,
+                                                       self.user, today)
 
                 global_['pyvac']['requests_count'] = requests_count
 
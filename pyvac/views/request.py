@@ -16,12 +16,14 @@ from pyramid.url import route_url
 from pyramid.settings import asbool
 
 from pyvac.models import (
-    Request, VacationType, User, RequestHistory, UserPool, Pool,
+    Request, VacationType, User, RequestHistory, UserPool, Pool, OffCache,
+    TeamIndex,
 )
 # from pyvac.helpers.i18n import trans as _
 from pyvac.helpers.calendar import delFromCal
 from pyvac.helpers.ldap import LdapCache
-from pyvac.helpers.holiday import get_holiday
+from pyvac.helpers.holiday import workdays
+from pyvac.helpers.interval import IntervalIndex
 from pyvac.helpers.util import daterange, JsonHTTPNotFound
 
 import yaml
@@ -57,13 +59,8 @@ class Send(View):
             date_to = datetime.strptime(dates[1], '%d/%m/%Y')
             breakdown = self.request.params.get('breakdown')
 
-            # retrieve holidays for user so we can remove them from selection
-            holidays = get_holiday(self.user, year=date_from.year,
-                                   use_datetime=True)
-
-            submitted = [d for d in daterange(date_from, date_to)
-                         if d.isoweekday() not in [6, 7]
-                         and d not in holidays]
+            # remove weekends and user holidays from selection
+            submitted = workdays(date_from, date_to, self.user.country)
             days = float(len(submitted))
 
             days_diff = (date_to - date_from).days
@@ -87,10 +84,9 @@ class Send(View):
             check_user = self.get_target_user(self.user)
             pool = dict([(k, v.amount) for k, v in list(check_user.pool.items())])
             # retrieve future requests for user so we can check overlap
-            futures = [d for req in
-                       Request.by_user_future(self.session, check_user)
-                       for d in daterange(req.date_from, req.date_to)]
-            intersect = set(futures) & set(submitted)
+            futures = IntervalIndex(Request.by_user_future(self.session,
+                                                           check_user))
+            intersect = set(d for d in submitted if futures.overlap(d, d))
             if intersect:
                 err_intersect = True
                 # must check for false warning in case of half day requests
@@ -98,10 +94,7 @@ class Send(View):
                     # only one date in conflict, check if it's for an half-day
                     dt = intersect.pop()
                     # retrieve the request for this date
-                    req = [req for req in
-                           Request.by_user_future(self.session, check_user)
-                           for d in daterange(req.date_from, req.date_to)
-                           if d == dt]
+                    req = futures.overlap(dt, dt)
                     if len(req) < 2:
                         req = req.pop()
                         if req.label != breakdown:
@@ -267,6 +260,7 @@ class Send(View):
                               )
             self.session.add(request)
             self.session.flush()
+            request.reset_cp_cache()
             # create history entry
             sudo_user = None
             if sudo_use:
@@ -318,9 +312,10 @@ class List(View):
     def get_conflict(self, requests):
         """ Returns requests conflicts """
         conflicts = {}
+        in_conflict = Request.in_conflict_batch(self.session, requests,
+                                                ou=True)
         for req in requests:
-            req.conflict = [req2.summary for req2 in
-                            Request.in_conflict_ou(self.session, req)]
+            req.conflict = [req2.summary for req2 in in_conflict[req.id]]
             if req.conflict:
                 req.conflict = {'': req.conflict}
                 if req.id not in conflicts:
@@ -329,18 +324,17 @@ class List(View):
 
         return conflicts
 
-    def get_conflict_by_teams(self, requests, users_teams):
+    def get_conflict_by_teams(self, requests, team_index):
         """ Returns requests conflicts by teams """
         conflicts = {}
+        in_conflict = Request.in_conflict_batch(self.session, requests)
         for req in requests:
-            user_teams = users_teams.get(req.user.dn, [])
             matched = {}
             # for all requests in conflict with current req
-            for req2 in Request.in_conflict(self.session, req):
+            for req2 in in_conflict[req.id]:
                 # if we have some match between request teams
                 # and conflicting request teams
-                conflict_teams = users_teams.get(req2.user.dn, [])
-                common_set = set(conflict_teams) & set(user_teams)
+                common_set = team_index.common(req.user.dn, req2.user.dn)
                 if common_set:
                     for team in common_set:
                         if team not in matched:
@@ -409,14 +403,9 @@ class List(View):
                 use_ldap = asbool(settings.get('pyvac.use_ldap'))
 
             if use_ldap:
-                ldap = LdapCache()
-                users_teams = {}
-                for team, members in list(ldap.list_teams().items()):
-                    for member in members:
-                        users_teams.setdefault(member, []).append(team)
-
+                team_index = TeamIndex.get(self.session)
                 conflicts = self.get_conflict_by_teams(req_list['next'],
-                                                       users_teams)
+                                                       team_index)
             else:
                 conflicts = self.get_conflict(req_list['next'])
 
@@ -699,10 +688,7 @@ class Prevision(View):
             User.sync_ldap_info(self.session)
             ldap = LdapCache()
             user_attr = ldap.get_users_units()
-            users_teams = {}
-            for team, members in list(ldap.list_teams().items()):
-                for member in members:
-                    users_teams.setdefault(member, []).append(team)
+            users_teams = TeamIndex.get(self.session).users_teams
 
         return {'users_per_id': users_per_id,
                 'use_ldap': use_ldap,
@@ -727,11 +713,11 @@ class Off(View):
     def render(self):
         duration = self.request.params.get('duration')
 
-        def fmt_req_type(req):
-            label = ' %s' % req.label if req.label else ''
-            if duration and req.days > 1:
+        def fmt_req_type(off):
+            label = ' %s' % off['label'] if off['label'] else ''
+            if duration and off['days'] > 1:
                 label = '%s (until %s)' % (label,
-                                           req.date_to.strftime('%d/%m/%Y'))
+                                           off['date_to'].strftime('%d/%m/%Y'))
             return 'OFF%s' % label
 
         filter_nick = self.request.params.get('nick')
@@ -743,11 +729,15 @@ class Off(View):
         # remove unwanted chars from filter_date
         if filter_date:
             filter_date = re.sub('[^\d+]', '', filter_date)
+            try:
+                filter_date = datetime.strptime(filter_date, '%Y%m%d').date()
+            except ValueError:
+                return JsonHTTPNotFound({'message': ('%s is not a valid date'
+                                                     % filter_date)})
 
         if filter_nick:
             # retrieve all availables nicknames
-            all_nick = [nick.lower()
-                        for nick in User.get_all_nicknames(self.session)]
+            all_nick = OffCache.get_nicknames(self.session)
             if strict:
                 match = filter_nick.lower() in all_nick
             else:
@@ -758,11 +748,9 @@ class Off(View):
                 return JsonHTTPNotFound({'message': ('%s not found'
                                                      % filter_nick)})
 
-        requests = Request.get_active(self.session, filter_date)
-        data_name = dict([(req.user.name.lower(), fmt_req_type(req))
-                          for req in requests])
-        data_nick = dict([(req.user.nickname, fmt_req_type(req))
-                          for req in requests])
+        offs = OffCache.get_off(self.session, filter_date)
+        data_name = dict([(off['name'], fmt_req_type(off)) for off in offs])
+        data_nick = dict([(off['nick'], fmt_req_type(off)) for off in offs])
 
         ret = val = None
         if filter_nick:
@@ -1010,6 +998,15 @@ class History(View):
 
 class OverviewMixin(object):
 
+    def get_members(self, team_index, team):
+        """Return {user.id: user} of given team members."""
+        user_ids = team_index.user_ids(team)
+        if not user_ids:
+            return {}
+        return dict((user.id, user) for user in
+                    User.find(self.session,
+                              where=(User.id.in_(user_ids),)))
+
     def get_users_stats(self, users_per_id):
         entity_length = len(users_per_id)
         if not entity_length:
@@ -1027,33 +1024,26 @@ class OverviewMixin(object):
             if req.user not in today_off:
                 today_off.append(req.user)
 
-        # retrieve active requests since 15 days ago
-        date_from = today - relativedelta(days=15)
-
-        all_reqs = []
-        for user_id, user in list(users_per_id.items()):
-            user_req = Request.by_user_future_approved(self.session, user,
-                                                       date_from=date_from)
-            all_reqs.extend(user_req)
+        # retrieve active requests of all users within displayed days
+        start_date = today - timedelta(days=15)
+        stop_date = today + timedelta(days=15)
+        all_reqs = Request.by_users_approved(self.session, list(users_per_id),
+                                             start_date, stop_date)
 
-        # compute current month squad presence percentages
-        data_months = {}
+        # users off per day
+        users_off = {}
         for req in all_reqs:
             for dt in req.dates:
-                if dt.month not in data_months:
-                    data_months[dt.month] = {}
-                if dt.day not in data_months[dt.month]:
-                    data_months[dt.month][dt.day] = []
-                if req.user.login not in data_months[dt.month][dt.day]:
-                    data_months[dt.month][dt.day].append(req.user.login)
+                users_off.setdefault(dt.date(), set()).add(req.user_id)
 
+        # compute current month squad presence percentages
         data_days_current = []
         labels = []
-        start_date = today - timedelta(days=15)
-        stop_date = today + timedelta(days=15)
         for x in daterange(start_date, stop_date):
             labels.append("'%s'" % x.strftime('%d/%m'))
-            perc = ((entity_length - len(data_months.get(x.month, {}).get(x.day, []))) / float(entity_length) * 100)  # noqa
+            off_length = len(users_off.get(x.date(), ()))
+            perc = ((entity_length - off_length) /
+                    float(entity_length) * 100)
             perc = round(perc, 2)
             if x.isoweekday() in [6, 7]:
                 perc = 0.0
@@ -1075,35 +1065,28 @@ class SquadOverview(OverviewMixin, View):
     """Display a dashboard of request and presence for squad leaders."""
     squad_leaders = {}
 
-    def get_squad_stats(self, target_squad, users_entity):
+    def get_squad_stats(self, target_squad, team_index):
         # retrieve squad members
-        users_per_id = {}
-        for user in User.find(self.session):
-            if target_squad in users_entity.get(user.dn, []):
-                users_per_id[user.id] = user
-
+        users_per_id = self.get_members(team_index, target_squad)
         return self.get_users_stats(users_per_id)
 
     def render(self):
         # synchronise user groups/roles
         User.sync_ldap_info(self.session)
-        ldap = LdapCache()
-        users_entity = {}
-        for team, members in list(ldap.list_teams().items()):
-            for member in members:
-                users_entity.setdefault(member, []).append(team)
+        team_index = TeamIndex.get(self.session)
+        users_entity = team_index.users_teams
 
         # keep only managed users for managers
         # use all users for admin
         overviews = {}
         if self.user.is_admin or self.user.has_feature('squad_overview_full'):
             for _, target_squad in list(self.squad_leaders.items()):
-                squad_stats = self.get_squad_stats(target_squad, users_entity)
+                squad_stats = self.get_squad_stats(target_squad, team_index)
                 overviews.update({target_squad: squad_stats})
         elif self.user.is_manager:
             # retrieve logged squad leader
             target_squad = self.squad_leaders[self.user.login]
-            squad_stats = self.get_squad_stats(target_squad, users_entity)
+            squad_stats = self.get_squad_stats(target_squad, team_index)
             overviews = {target_squad: squad_stats}
         else:
             return HTTPFound(location=route_url('home', self.request))
@@ -1115,39 +1098,28 @@ class ChapterOverview(OverviewMixin, View):
     """Display a dashboard of request and presence for chapter leaders."""
     chapter_leaders = {}
 
-    def get_chapter_stats(self, target_chapter, users_entity):
+    def get_chapter_stats(self, target_chapter, chapter_index):
         # retrieve chapter members
-        users_per_id = {}
-        for user_dn, chapters in list(users_entity.items()):
-            if target_chapter not in chapters:
-                continue
-            user = User.by_dn(self.session, user_dn)
-            if not user:
-                continue
-            users_per_id[user.id] = user
-
+        users_per_id = self.get_members(chapter_index, target_chapter)
         return self.get_users_stats(users_per_id)
 
     def render(self):
         # synchronise user groups/roles
         User.sync_ldap_info(self.session)
-        ldap = LdapCache()
-        users_entity = {}
-        for chapter, members in list(ldap.list_chapters().items()):
-            for member in members:
-                users_entity.setdefault(member, []).append(chapter)
+        chapter_index = TeamIndex.get(self.session, 'chapters')
+        users_entity = chapter_index.users_teams
 
         # keep only managed users for managers
         # use all users for admin
         overviews = {}
         if self.user.is_admin or self.user.has_feature('chapter_overview_full'):  # noqa
             for _, target_chapter in list(self.chapter_leaders.items()):
-                chapter_stats = self.get_chapter_stats(target_chapter, users_entity)  # noqa
+                chapter_stats = self.get_chapter_stats(target_chapter, chapter_index)  # noqa
                 overviews.update({target_chapter: chapter_stats})
         elif self.user.is_manager:
             # retrieve logged chapter leader
             target_chapter = self.chapter_leaders[self.user.login]
-            chapter_stats = self.get_chapter_stats(target_chapter, users_entity) # noqa
+            chapter_stats = self.get_chapter_stats(target_chapter, chapter_index) # noqa
             overviews = {target_chapter: chapter_stats}
         else:
             return HTTPFound(location=route_url('home', self.request))
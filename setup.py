@@ -72,6 +72,7 @@ setup(name='pyvac',
       pyvac_celeryd = pyvac.bin.celerycmd:celeryd
       pyvac_import = pyvac.bin.importldap:main
       pyvac_replay = pyvac.bin.replay:main
+      pyvac_upgrade = pyvac.bin.upgrade:main
       """,
       data_files=data_files,
       )